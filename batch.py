@@ -0,0 +1,192 @@
+import numpy as np
+
+from bellman import BellmanSweeper
+from distances import UNREACHABLE, label_components, wavefront_distances
+from moves import REVERSE, WAIT
+from placement import place_agents
+
+# Many independent tag games stepped together. The maps are a stacked
+# (games, rows, columns) wall tensor and each agent's position a (games, 2)
+# array; rewards, Bellman sweeps, action choice, moves and terminal checks
+# run as array operations over all games that are still going.
+#
+# Actions are indices into moves.ACTIONS, WAIT for waiting. The per-game
+# rules follow tagmdp_2: the Runner never waits and breaks ties towards the
+# first best action, the Tagger waits with probability 1 - alpha and breaks
+# ties towards the last one, both explore with probability epsilon and may
+# not reverse their previous action.
+MOVES = np.array([[-1, 0], [1, 0], [0, -1], [0, 1]])
+RUNNER, TAGGER = 0, 1
+
+# The distances from every cell an agent stood on are kept while a
+# (games, cells, rows, columns) uint16 table fits in this many bytes.
+DISTANCE_BUDGET = 256 * 2**20
+
+
+def random_maps(num_games, num_rows, num_columns, wall_probability, rng):
+    # Connected maps, as placement.fill_pockets makes them, with both agents
+    # placed by placement.place_agents, so every Tagger can reach its Runner.
+    walls = rng.random((num_games, num_rows, num_columns), dtype=np.float32) < wall_probability
+    walls[:, [0, -1], :] = True
+    walls[:, :, [0, -1]] = True
+    # Every map is walled in, so the maps stacked into one tall grid are
+    # labelled in a single pass without components running across maps.
+    labels, count = label_components(walls.reshape(-1, num_columns))
+    labels = labels.reshape(walls.shape)
+    free = labels >= 0
+    sizes = np.bincount(labels[free], minlength=count)
+    component_games = np.zeros(count, dtype=np.int64)
+    component_games[labels[free]] = np.nonzero(free)[0]
+    # The largest component of each map, the first one on ties.
+    order = np.lexsort((np.arange(count), -sizes, component_games))
+    largest = np.zeros(count + 1, dtype=bool)
+    largest[order[np.diff(component_games[order], prepend=-1) != 0]] = True
+    walls |= ~largest[labels]
+    components = np.where(walls, -1, 0).astype(np.int32)
+    runners = np.empty((num_games, 2), dtype=np.int64)
+    taggers = np.empty((num_games, 2), dtype=np.int64)
+    for game in range(num_games):
+        runners[game], taggers[game] = place_agents(walls[game], rng, (components[game], 1))
+    return walls, runners, taggers
+
+
+class BatchGame:
+    def __init__(self, walls, runners, taggers, max_turns, iterations, gamma=1, epsilon=0.05, alpha=0.95, sweep_mode="jacobi", rng=None, distance_budget=DISTANCE_BUDGET):
+        self.walls = np.array(walls, dtype=bool)
+        self.num_games, self.num_rows, self.num_columns = self.walls.shape
+        self.positions = np.stack([np.array(runners), np.array(taggers)]).astype(np.int64)
+        self.max_turns = np.broadcast_to(max_turns, self.num_games)
+        self.iterations = iterations
+        self.gamma = gamma
+        self.epsilon = epsilon
+        self.alpha = alpha
+        self.sweep_mode = sweep_mode
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.q_sa = np.zeros((2,) + self.walls.shape)
+        self.previous_actions = np.full((2, self.num_games), WAIT)
+        self.turn_counter = 0
+        self.done = np.zeros(self.num_games, dtype=bool)
+        self.winners = np.zeros(self.num_games, dtype=np.int8)
+        self.turns = np.zeros(self.num_games, dtype=np.int32)
+        self.interior = np.zeros((self.num_rows, self.num_columns), dtype=bool)
+        self.interior[1:-1, 1:-1] = True
+        # The walls never change, so the BFS from a cell of a map is run the
+        # first time an agent stands there and looked up afterwards.
+        cells = self.num_rows * self.num_columns
+        self.distances = None
+        if self.num_games * cells * cells * 2 <= distance_budget:
+            self.distances = np.empty((self.num_games, cells, self.num_rows, self.num_columns), dtype=np.uint16)
+            self.searched = np.zeros((self.num_games, cells), dtype=bool)
+
+    @classmethod
+    def random(cls, num_games, map_height, map_width, wall_prob, max_turns, iterations, rng=None, **options):
+        rng = np.random.default_rng() if rng is None else rng
+        walls, runners, taggers = random_maps(num_games, map_height, map_width, wall_prob, rng)
+        return cls(walls, runners, taggers, max_turns, iterations, rng=rng, **options)
+
+    def check_terminal(self):
+        # Same order as Game.run: reaching max_turns wins for the Runner even
+        # if the agents are adjacent at that point.
+        runners, taggers = self.positions
+        tagged = np.abs(runners - taggers).sum(axis=1) == 1
+        over = self.turn_counter >= self.max_turns
+        finished = ~self.done & (tagged | over)
+        self.winners[finished] = np.where(over[finished], 1, -1)
+        self.turns[finished] = self.turn_counter
+        self.done |= finished
+
+    def distances_from(self, games, positions):
+        # (games, rows, columns) distances from positions on the maps of games.
+        if self.distances is None:
+            return wavefront_distances(self.walls[games], positions)
+        cells = positions[:, 0] * self.num_columns + positions[:, 1]
+        missing = ~self.searched[games, cells]
+        if missing.any():
+            self.distances[games[missing], cells[missing]] = wavefront_distances(self.walls[games[missing]], positions[missing])
+            self.searched[games[missing], cells[missing]] = True
+        return self.distances[games, cells]
+
+    def reward_functions(self, agent, games):
+        # Batched Runner.reward_function / Tagger.reward_function.
+        opponent = self.positions[1 - agent, games]
+        if agent == RUNNER:
+            distance = self.distances_from(games, opponent).astype(float)
+            distance[distance == UNREACHABLE] = 0
+            max_distance = np.maximum(self.num_rows + self.num_columns - 2, distance.max(axis=(1, 2)))
+            return -(max_distance[:, np.newaxis, np.newaxis] - distance)
+        # The Tagger's reward only tells the Runner's cell (distance 0) and
+        # its free neighbours (distance 1) apart, so no search is needed.
+        reward = 1
+        walls = self.walls[games]
+        rewards = np.full(walls.shape, -1.0)
+        rewards[walls] = -3
+        rows = np.arange(len(games))[:, np.newaxis]
+        neighbours = opponent[:, np.newaxis, :] + MOVES
+        inside = (neighbours >= 0).all(axis=2) & (neighbours[..., 0] < self.num_rows) & (neighbours[..., 1] < self.num_columns)
+        neighbours[..., 0] = np.clip(neighbours[..., 0], 0, self.num_rows - 1)
+        neighbours[..., 1] = np.clip(neighbours[..., 1], 0, self.num_columns - 1)
+        free = inside & ~walls[rows, neighbours[..., 0], neighbours[..., 1]]
+        rows = np.broadcast_to(rows, free.shape)
+        rewards[rows[free], neighbours[..., 0][free], neighbours[..., 1][free]] = reward - 1
+        rewards[np.arange(len(games)), opponent[:, 0], opponent[:, 1]] = reward
+        return rewards
+
+    def q_value_updates(self, agent, games):
+        rewards = self.reward_functions(agent, games)
+        own = self.positions[agent, games]
+        goal = np.zeros(rewards.shape, dtype=bool)
+        goal[np.arange(len(games)), own[:, 0], own[:, 1]] = True
+        update = self.interior & ~goal
+        sweeper = BellmanSweeper(update, goal, gamma=self.gamma, mode=self.sweep_mode)
+        q_sa = self.q_sa[agent, games]
+        sweeper.run(q_sa, rewards, self.iterations)
+        self.q_sa[agent, games] = q_sa
+        return q_sa
+
+    def best_actions(self, agent, games, q_sa):
+        count = len(games)
+        positions = self.positions[agent, games]
+        targets = positions[:, np.newaxis, :] + MOVES
+        inside = (targets >= 0).all(axis=2) & (targets[..., 0] < self.num_rows) & (targets[..., 1] < self.num_columns)
+        targets[..., 0] = np.clip(targets[..., 0], 0, self.num_rows - 1)
+        targets[..., 1] = np.clip(targets[..., 1], 0, self.num_columns - 1)
+        rows = np.arange(count)[:, np.newaxis]
+        valid = inside & ~self.walls[games[:, np.newaxis], targets[..., 0], targets[..., 1]]
+        valid &= np.arange(4) != REVERSE[self.previous_actions[agent, games]][:, np.newaxis]
+        q_values = np.where(valid, q_sa[rows, targets[..., 0], targets[..., 1]], -np.inf)
+
+        if agent == RUNNER:
+            actions = np.where(valid.any(axis=1), np.argmax(q_values, axis=1), WAIT)
+        else:
+            # >= from -999999 in Agent.best_action: the last best action wins.
+            q_values[q_values < -999999] = -np.inf
+            last = 3 - np.argmax(q_values[:, ::-1], axis=1)
+            actions = np.where(np.isfinite(q_values).any(axis=1), last, WAIT)
+
+        explore = self.rng.random(count) < self.epsilon
+        random_actions = self.rng.integers(0, 4, count)
+        explore &= valid[np.arange(count), random_actions]
+        actions = np.where(explore, random_actions, actions)
+        if agent == TAGGER:
+            actions[self.rng.random(count) > self.alpha] = WAIT
+        return actions
+
+    def step(self):
+        # Plays one turn in every unfinished game; False once all are done.
+        self.check_terminal()
+        games = np.flatnonzero(~self.done)
+        if games.size == 0:
+            return False
+        agent = RUNNER if self.turn_counter % 2 == 0 else TAGGER
+        q_sa = self.q_value_updates(agent, games)
+        actions = self.best_actions(agent, games, q_sa)
+        moving = actions != WAIT
+        self.positions[agent, games[moving]] += MOVES[actions[moving]]
+        self.previous_actions[agent, games] = actions
+        self.turn_counter += 1
+        return True
+
+    def run(self):
+        while self.step():
+            pass
+        return self.winners
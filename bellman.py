@@ -0,0 +1,437 @@
+from collections import namedtuple
+
+import numpy as np
+
+# Vectorized Bellman sweeps over a grid of Q values.
+#
+# Every cell is one of three kinds: UPDATE cells are relaxed with
+# q = reward + gamma * max(4 neighbours), FIXED cells are reset to a constant
+# each sweep (goals, borders, walls) and KEEP cells are left untouched.
+# Neighbours wrap around the edges the same way negative indices do in the
+# original Python loops. Grids may carry leading batch axes (..., rows, columns)
+# in every mode but "inplace".
+#
+# Sweep modes:
+#   "inplace"  - same row-major, in-place order as the original loops, so the
+#                results match them exactly. Each row is solved with a single
+#                max-plus scan instead of a Python loop over the columns.
+#   "jacobi"   - every cell is updated from the previous sweep (fully vectorized).
+#   "redblack" - Gauss-Seidel on a checkerboard: one colour after the other.
+SWEEP_MODES = ("inplace", "jacobi", "redblack")
+
+KEEP, UPDATE, FIXED = 0, 1, 2
+
+# Outcome of BellmanSweeper.solve: sweeps done, max-norm change of the last
+# sweep and whether that change fell within the tolerance.
+SweepReport = namedtuple("SweepReport", ["sweeps", "residual", "converged"])
+
+
+def border_masks(shape, goal, border_value=None):
+    # Masks for the usual layout: the goal cell is pinned to 0 and the
+    # interior is relaxed. Border cells are kept as they are, or pinned to
+    # border_value when one is given.
+    num_rows, num_columns = shape
+    border = np.zeros(shape, dtype=bool)
+    border[[0, -1], :] = True
+    border[:, [0, -1]] = True
+    fixed = np.zeros(shape, dtype=bool)
+    values = np.zeros(shape)
+    if border_value is not None:
+        fixed |= border
+        values[border] = border_value
+    update = ~border
+    if goal is not None:
+        fixed[goal] = True
+        values[goal] = 0
+        update[goal] = False
+    return update, fixed, values
+
+
+def terminal_masks(reward):
+    # Masks for a table that ends on reaching a goal: the cells of
+    # non-negative reward are terminal and pinned to it, every other cell is
+    # relaxed. With the walls pinned out too (BellmanSweeper's walls) the
+    # Tagger's rewards leave a uniform step cost, for wavefront.
+    terminal = np.asarray(reward) >= 0
+    return ~terminal, terminal, np.where(terminal, reward, 0)
+
+
+class BellmanSweeper:
+    def __init__(self, update_mask, fixed_mask=None, fixed_values=None, gamma=1, mode="inplace", walls=None):
+        if mode not in SWEEP_MODES:
+            raise ValueError(f"Unknown sweep mode {mode!r}, expected one of {SWEEP_MODES}")
+        self.gamma = gamma
+        self.mode = mode
+        self.update_mask = np.array(update_mask, dtype=bool)
+        self.shape = self.update_mask.shape
+        if fixed_mask is None:
+            self.fixed_mask = np.zeros(self.shape, dtype=bool)
+        else:
+            self.fixed_mask = np.array(fixed_mask, dtype=bool)
+        self.fixed_values = np.zeros(self.shape)
+        if fixed_values is not None:
+            self.fixed_values[...] = fixed_values
+        if walls is not None:
+            # Walls are never entered: pinning them to -inf keeps them out of
+            # every neighbour max.
+            self.fixed_mask |= walls
+            self.fixed_values[walls] = -np.inf
+        self.update_mask &= ~self.fixed_mask
+
+        self._max_buffer = np.empty(self.shape)
+        self._previous = np.empty(self.shape)
+        self._shift_buffer = np.empty(self.shape)
+        self._neighbour_table = None
+        if mode == "redblack":
+            rows, cols = np.indices(self.shape[-2:])
+            red = (rows + cols) % 2 == 0
+            self._colours = (self.update_mask & red, self.update_mask & ~red)
+        elif mode == "inplace":
+            if len(self.shape) != 2:
+                raise ValueError("The inplace sweep mode only handles a single grid")
+            self._row_segments = self._segment_rows()
+
+    def _segment_rows(self):
+        kinds = np.full(self.shape, KEEP, dtype=np.int8)
+        kinds[self.update_mask] = UPDATE
+        kinds[self.fixed_mask] = FIXED
+        num_columns = self.shape[1]
+        row_segments = []
+        for i, row in enumerate(kinds):
+            starts = np.concatenate(([0], np.flatnonzero(np.diff(row)) + 1))
+            stops = np.append(starts[1:], num_columns)
+            segments = [(int(s), int(e), row[s]) for s, e in zip(starts, stops) if row[s] != KEEP]
+            if segments:
+                row_segments.append((i, segments))
+        return row_segments
+
+    def neighbour_max(self, q):
+        # max(up, down, left, right) for every cell, built from shifted views
+        # into two preallocated buffers.
+        out = self._max_buffer
+        shifted = self._shift_buffer
+        out[..., 1:, :] = q[..., :-1, :]
+        out[..., 0, :] = q[..., -1, :]
+        shifted[..., :-1, :] = q[..., 1:, :]
+        shifted[..., -1, :] = q[..., 0, :]
+        np.maximum(out, shifted, out=out)
+        shifted[..., 1:] = q[..., :-1]
+        shifted[..., 0] = q[..., -1]
+        np.maximum(out, shifted, out=out)
+        shifted[..., :-1] = q[..., 1:]
+        shifted[..., -1] = q[..., 0]
+        np.maximum(out, shifted, out=out)
+        return out
+
+    def _relax(self, q, reward, where):
+        target = self.neighbour_max(q)
+        target *= self.gamma
+        target += reward
+        np.copyto(q, target, where=where)
+
+    def _sweep_inplace(self, q, reward):
+        gamma = self.gamma
+        num_rows, num_columns = self.shape
+        for i, segments in self._row_segments:
+            up = q[i - 1]
+            down = q[(i + 1) % num_rows]
+            row = q[i]
+            for start, stop, kind in segments:
+                if kind == FIXED:
+                    row[start:stop] = self.fixed_values[i, start:stop]
+                    continue
+                # Everything except the left neighbour is known before the
+                # row is touched: up is already swept, down and right are not.
+                best = np.maximum(up[start:stop], down[start:stop])
+                right = np.roll(row, -1)[start:stop] if stop == num_columns else row[start + 1:stop + 1]
+                np.maximum(best, right, out=best)
+                left = row[start - 1]
+                r = reward[i, start:stop]
+                if gamma == 1:
+                    # q_j = r_j + max(best_j, q_j-1) is a max-plus recurrence:
+                    # q_j = S_j + max(left, max_k<=j(best_k - S_k-1)), S = cumsum(r)
+                    total = np.cumsum(r)
+                    best -= total - r
+                    best[0] = max(best[0], left)
+                    np.maximum.accumulate(best, out=best)
+                    best += total
+                    row[start:stop] = best
+                else:
+                    previous = left
+                    for k in range(stop - start):
+                        previous = r[k] + gamma * max(best[k], previous)
+                        row[start + k] = previous
+
+    def sweep(self, q, reward):
+        if self.mode == "inplace":
+            self._sweep_inplace(q, reward)
+            return q
+        np.copyto(q, self.fixed_values, where=self.fixed_mask)
+        if self.mode == "jacobi":
+            self._relax(q, reward, self.update_mask)
+        else:
+            for colour in self._colours:
+                self._relax(q, reward, colour)
+        return q
+
+    def run(self, q, reward, sweeps):
+        for _ in range(sweeps):
+            self.sweep(q, reward)
+        return q
+
+    def solve(self, q, reward, max_sweeps, tolerance=None):
+        # Sweep until the largest change of an updated cell is at most
+        # tolerance, or max_sweeps have been done. Without a tolerance this
+        # is run() plus a report of the last sweep's residual.
+        residual = np.inf
+        for sweep in range(1, max_sweeps + 1):
+            np.copyto(self._previous, q)
+            self.sweep(q, reward)
+            residual = self.residual(q, self._previous)
+            if tolerance is not None and residual <= tolerance:
+                return SweepReport(sweep, residual, True)
+        converged = tolerance is not None and residual <= tolerance
+        return SweepReport(max_sweeps, residual, converged)
+
+    def relax(self, q, reward, max_sweeps, tolerance=None):
+        # Warm-started Jacobi passes: q is taken as the previous turn's
+        # solution. The first pass relaxes the cells whose Bellman error
+        # exceeds the tolerance, and each later pass the neighbours of the
+        # cells the last one changed, until nothing changes by more than the
+        # tolerance or max_sweeps passes are done. Every pass is one masked
+        # full-grid Jacobi sweep and is counted as a sweep. This only pays
+        # when the rewards and goal barely moved, or a tolerance lets it stop
+        # early: a goal that moved changes values all over the map, which
+        # takes as many passes as a cold solve. Rewards must be ones the
+        # sweeps settle for (no cycle of cells gaining value every lap).
+        tolerance = 0.0 if tolerance is None else tolerance
+        np.copyto(q, self.fixed_values, where=self.fixed_mask)
+        active = self.bellman_error(q, reward) > tolerance
+        sweeps = 0
+        while sweeps < max_sweeps and active.any():
+            target = self.neighbour_max(q)
+            target *= self.gamma
+            target += reward
+            with np.errstate(invalid="ignore"):
+                moved = active & (np.abs(target - q) > tolerance)
+            np.copyto(q, target, where=moved)
+            sweeps += 1
+            active = _grow(moved) & self.update_mask
+        residual = float(self.bellman_error(q, reward).max(initial=0.0))
+        return SweepReport(sweeps, residual, residual <= tolerance)
+
+    def bellman_error(self, q, reward):
+        # |reward + gamma * max(neighbours) - q| on updated cells, 0 elsewhere.
+        error = self.neighbour_max(q) * self.gamma
+        error += reward
+        # Cells stuck at -inf (walls, dead ends) give nan, counted as 0.
+        with np.errstate(invalid="ignore"):
+            error -= q
+        np.abs(error, out=error)
+        error[~self.update_mask] = 0
+        error[np.isnan(error)] = 0
+        return error
+
+    def neighbour_table(self):
+        # (cells, 4) flat (up, down, left, right) indices of every cell,
+        # wrapping at the edges like neighbour_max does.
+        if self._neighbour_table is None:
+            index = np.arange(self.update_mask.size).reshape(self.shape)
+            self._neighbour_table = np.stack([
+                np.roll(index, 1, axis=-2), np.roll(index, -1, axis=-2),
+                np.roll(index, 1, axis=-1), np.roll(index, -1, axis=-1),
+            ], axis=-1).reshape(-1, 4)
+        return self._neighbour_table
+
+    def step_cost(self, q, reward):
+        # The cost c of one step when the exact fixed point is a shortest
+        # path problem: gamma is 1, every updated cell has the same reward -c
+        # < 0 and the values of the pinned cells (fixed values, or q on kept
+        # cells) differ by whole steps. None otherwise.
+        if self.gamma != 1:
+            return None
+        rewards = np.broadcast_to(reward, self.shape)[self.update_mask]
+        if rewards.size == 0 or not rewards[0] < 0 or np.any(rewards != rewards[0]):
+            return None
+        cost = -float(rewards[0])
+        values = np.where(self.fixed_mask, self.fixed_values, q)[~self.update_mask]
+        values = values[np.isfinite(values)]
+        if values.size and np.any((values.max() - values) % cost != 0):
+            return None
+        return cost
+
+    def wavefront(self, q, reward):
+        # Exact fixed point of the sweeps in one multi-source BFS when
+        # step_cost finds one, else None (sweep instead). The pinned cells of
+        # finite value are the sources; one of value v enters the wavefront
+        # (top - v) / c steps late, so a cell first reached at step k is worth
+        # top - c * k = max over sources of (v - c * distance). Each step only
+        # touches the cells on the frontier: O(rows * columns) in all.
+        # Updated cells no source reaches go to -inf, where sweeps head for.
+        # The report counts wavefront steps as sweeps.
+        cost = self.step_cost(q, reward)
+        if cost is None:
+            return None
+        np.copyto(q, self.fixed_values, where=self.fixed_mask)
+        flat = q.ravel()
+        update = self.update_mask.reshape(-1)
+        sources = np.flatnonzero(~update & np.isfinite(flat))
+        result = np.full(flat.shape, -np.inf)
+        if sources.size:
+            top = flat[sources].max()
+            delays = ((top - flat[sources]) // cost).astype(np.int64)
+            order = np.argsort(delays, kind="stable")
+            sources, delays = sources[order], delays[order]
+            unvisited = update.copy()
+            table = self.neighbour_table()
+            stamp = np.empty(flat.size, dtype=np.int64)
+            frontier = sources[:np.searchsorted(delays, 0, side="right")]
+            injected = frontier.size
+            step = 0
+            while frontier.size or injected < sources.size:
+                step += 1
+                reached = table[frontier].ravel()
+                reached = reached[unvisited[reached]]
+                # Keep one copy of every cell reached from several sides.
+                stamp[reached] = np.arange(reached.size)
+                reached = reached[stamp[reached] == np.arange(reached.size)]
+                unvisited[reached] = False
+                result[reached] = top - cost * step
+                stop = np.searchsorted(delays, step, side="right")
+                frontier = np.concatenate([reached, sources[injected:stop]])
+                injected = stop
+        else:
+            step = 0
+        np.copyto(q, result.reshape(self.shape), where=self.update_mask)
+        return SweepReport(step, 0.0, True)
+
+    def residual(self, q, previous):
+        # Cells stuck at -inf (walls, dead ends) give nan and have not moved.
+        with np.errstate(invalid="ignore"):
+            delta = np.abs(q - previous)
+        return float(np.max(delta, initial=0.0, where=~np.isnan(delta)))
+
+
+def _grow(mask):
+    # mask and its 4 neighbours, wrapping at the edges like neighbour_max.
+    grown = mask.copy()
+    grown[..., 1:, :] |= mask[..., :-1, :]
+    grown[..., 0, :] |= mask[..., -1, :]
+    grown[..., :-1, :] |= mask[..., 1:, :]
+    grown[..., -1, :] |= mask[..., 0, :]
+    grown[..., 1:] |= mask[..., :-1]
+    grown[..., 0] |= mask[..., -1]
+    grown[..., :-1] |= mask[..., 1:]
+    grown[..., -1] |= mask[..., 0]
+    return grown
+
+
+class TiledSweeper:
+    # Jacobi sweeps for grids that do not fit in memory several times over,
+    # such as memory-mapped float32 Q tables (storage.open_q_table). The
+    # masks of the usual layout (see border_masks) are built per tile instead
+    # of for the whole grid, and every sweep reads one buffer and writes the
+    # other tile_bytes worth of rows at a time, so the resident memory is a
+    # few tiles whatever the grid size. Results match BellmanSweeper's
+    # "jacobi" mode on the same layout. Walls (a bool grid or a PackedWalls)
+    # are pinned to -inf as in BellmanSweeper.
+    def __init__(self, shape, goal=None, border_value=None, gamma=1, walls=None, tile_bytes=16 * 2**20):
+        self.shape = tuple(shape)
+        self.goal = goal
+        self.border_value = border_value
+        self.gamma = gamma
+        self.walls = walls
+        # Rows per tile, counting the float64 buffers one tile needs.
+        self.tile_rows = max(1, tile_bytes // (self.shape[1] * 8 * 6))
+
+    def tiles(self):
+        for start in range(0, self.shape[0], self.tile_rows):
+            yield start, min(start + self.tile_rows, self.shape[0])
+
+    def _tile_masks(self, start, stop):
+        num_rows, num_columns = self.shape
+        rows = np.arange(start, stop)[:, np.newaxis]
+        border = (rows == 0) | (rows == num_rows - 1) | np.zeros((1, num_columns), dtype=bool)
+        border[:, [0, -1]] = True
+        fixed = np.zeros(border.shape, dtype=bool)
+        values = np.zeros(border.shape)
+        if self.border_value is not None:
+            fixed |= border
+            values[border] = self.border_value
+        update = ~border
+        if self.goal is not None and start <= self.goal[0] < stop:
+            goal = (self.goal[0] - start, self.goal[1])
+            fixed[goal] = True
+            values[goal] = 0
+            update[goal] = False
+        if self.walls is not None:
+            walls = np.asarray(self.walls[start:stop], dtype=bool)
+            fixed |= walls
+            values[walls] = -np.inf
+        update &= ~fixed
+        return update, fixed, values
+
+    def _pin(self, q):
+        # Writes the fixed values into q; returns the largest change.
+        change = 0.0
+        for start, stop in self.tiles():
+            _, fixed, values = self._tile_masks(start, stop)
+            tile = q[start:stop]
+            change = max(change, _max_change(values[fixed], tile[fixed]))
+            tile[fixed] = values[fixed]
+        return change
+
+    def _sweep(self, source, target, reward):
+        num_rows = self.shape[0]
+        residual = 0.0
+        for start, stop in self.tiles():
+            update, _, _ = self._tile_masks(start, stop)
+            window = np.empty((stop - start + 2, self.shape[1]))
+            window[0] = source[(start - 1) % num_rows]
+            window[1:-1] = source[start:stop]
+            window[-1] = source[stop % num_rows]
+            middle = window[1:-1]
+            best = np.maximum(window[:-2], window[2:])
+            np.maximum(best[:, 1:], middle[:, :-1], out=best[:, 1:])
+            np.maximum(best[:, 0], middle[:, -1], out=best[:, 0])
+            np.maximum(best[:, :-1], middle[:, 1:], out=best[:, :-1])
+            np.maximum(best[:, -1], middle[:, 0], out=best[:, -1])
+            best *= self.gamma
+            best += reward if np.ndim(reward) == 0 else reward[start:stop]
+            new = np.where(update, best, middle)
+            residual = max(residual, _max_change(new, middle))
+            target[start:stop] = new
+        return residual
+
+    def solve(self, q, reward, max_sweeps, tolerance=None, scratch=None):
+        # Same contract as BellmanSweeper.solve. scratch is the second buffer
+        # of the double buffering, of q's shape; pass a memory-mapped one
+        # (storage.open_q_table) for grids that must stay on disk.
+        # reward may be a scalar or any array-like sliceable by rows.
+        scratch = np.empty_like(q) if scratch is None else scratch
+        source, target = q, scratch
+        residual = np.inf
+        pinned = self._pin(q)
+        sweep = 0
+        for sweep in range(1, max_sweeps + 1):
+            residual = self._sweep(source, target, reward)
+            if sweep == 1:
+                residual = max(residual, pinned)
+            source, target = target, source
+            if tolerance is not None and residual <= tolerance:
+                break
+        if source is not q:
+            for start, stop in self.tiles():
+                q[start:stop] = source[start:stop]
+        converged = tolerance is not None and residual <= tolerance
+        return SweepReport(sweep, residual, converged)
+
+    def run(self, q, reward, sweeps, scratch=None):
+        self.solve(q, reward, sweeps, scratch=scratch)
+        return q
+
+
+def _max_change(new, old):
+    with np.errstate(invalid="ignore"):
+        delta = np.abs(np.asarray(new, dtype=float) - old)
+    return float(np.max(delta, initial=0.0, where=~np.isnan(delta)))
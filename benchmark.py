@@ -0,0 +1,347 @@
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import tagMDP
+from joint import JointSolver
+from tagmdp_2 import Game
+
+# Timings of the hot paths of both engines (tagmdp_2 and the legacy tagMDP,
+# whose cases start with "tagMDP.") on a fixed corpus of seeded maps, one
+# case at a time and without console I/O.
+#
+#   python benchmark.py run --output baseline.json
+#   python benchmark.py run --output current.json
+#   python benchmark.py compare baseline.json current.json
+#   python benchmark.py complexity
+#   python benchmark.py joint
+#   python benchmark.py startup
+#
+# Every corpus entry is (size, wall_prob, seed); the map and the agents'
+# placement only depend on that entry, so two runs time the same work.
+# Results are keyed "case/size/wall_prob" and hold percentiles in seconds.
+# compare flags every case whose median got slower than the threshold.
+# complexity times q_value_update over a grid of map sizes and iteration
+# counts and fails if its cost grows faster than O(iterations * rows * columns).
+# joint times JointSolver sweeps and fails if one costs more than the
+# threshold per joint state.
+# startup imports each game module in fresh interpreters, as a spawned worker
+# does, and fails if one takes longer than the threshold on top of numpy or
+# does not import cleanly without a terminal (stdin closed).
+SIZES = (11, 51, 101, 251, 501)
+WALL_PROBS = (0.1, 0.2, 0.3)
+PERCENTILES = (50, 90, 99)
+COMPLEXITY_SIZES = (41, 81, 161, 321)
+COMPLEXITY_ITERATIONS = (10, 20, 40, 80)
+JOINT_SIZES = (16, 32, 64)
+STARTUP_MODULES = ("tagMDP", "tagmdp_2", "experiment")
+
+
+def corpus(sizes=SIZES, wall_probs=WALL_PROBS):
+    return [(size, wall_prob, seed) for seed, (size, wall_prob) in enumerate((s, p) for s in sizes for p in wall_probs)]
+
+
+def new_game(entry, max_turns, iterations, **game_options):
+    size, wall_prob, seed = entry
+    return Game(max_turns, iterations, size, size, wall_prob, rng=np.random.SeedSequence(seed), **game_options)
+
+
+def new_state(entry, sweep_mode="inplace", tolerance=None, incremental=False, solver="sweeps", connected=False):
+    # The legacy engine's GameState and map for entry, with the game options
+    # tagMDP has a counterpart for. Both engines draw a seed's map the same
+    # way, so this is the map new_game plays on.
+    size, wall_prob, seed = entry
+    state = tagMDP.GameState(np.random.SeedSequence(seed), sweepMode=sweep_mode, wavefrontSolve=solver == "wavefront", tolerance=tolerance, warmStart=incremental)
+    tagMDP.setMap(state, tagMDP.generate_random_map(size, size, wall_prob, state.mapRng, connected))
+    return state
+
+
+def time_calls(function, repeats, setup=None, number=1):
+    # repeats samples of the seconds per call of function(), each the mean of
+    # number back-to-back calls, with setup() run untimed before each sample.
+    times = []
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeats):
+            if setup is not None:
+                setup()
+            start_time = time.perf_counter()
+            for _ in range(number):
+                function()
+            times.append((time.perf_counter() - start_time) / number)
+    finally:
+        gc.enable()
+    return times
+
+
+def summary(times, **extra):
+    times = np.array(times)
+    result = {f"p{q}": float(np.percentile(times, q)) for q in PERCENTILES}
+    result.update(min=float(times.min()), mean=float(times.mean()), repeats=len(times))
+    result.update(extra)
+    return result
+
+
+def bench_entry(entry, repeats, max_turns, iterations, **game_options):
+    results = {}
+    game = new_game(entry, max_turns, iterations, **game_options)
+    runner, tagger = game.runner, game.tagger
+    # The free-cell graph is built once per map in a game, but every turn
+    # searches from a new opponent position: the reward cases keep the graph
+    # and forget the searched rows before each call.
+    field = game.game_map.distance_field
+
+    def reset(agent):
+        return lambda: agent.q_sa.fill(0)
+
+    for agent in (runner, tagger):
+        prefix = "runner" if agent is runner else "tagger"
+        results[prefix + ".reward_function"] = summary(time_calls(agent.reward_function, repeats, field.clear))
+        reports = []
+        times = time_calls(lambda: reports.append(agent.q_value_update(iterations, tolerance=game.tolerance)), repeats, reset(agent))
+        sweeps = np.mean([report.sweeps for report in reports])
+        results[prefix + ".q_value_update"] = summary(times, sweeps=float(sweeps), sweeps_per_second=float(sweeps / np.median(times)))
+        results[prefix + ".best_action"] = summary(time_calls(agent.best_action, repeats, number=100))
+    results["find_agent_location"] = summary(time_calls(lambda: game.game_map.find_agent_location("T"), repeats, number=1000))
+
+    turns = []
+
+    def play():
+        game = new_game(entry, max_turns, iterations, **game_options)
+        game.run()
+        turns.append(game.turn_counter)
+
+    times = time_calls(play, max(1, repeats // 2))
+    results["game.run"] = summary(times, turns=float(np.mean(turns)), turns_per_second=float(np.sum(turns) / np.sum(times)))
+    results.update(bench_legacy_entry(entry, repeats, max_turns, iterations, **game_options))
+    return results
+
+
+def bench_legacy_entry(entry, repeats, max_turns, iterations, **game_options):
+    # The same cases for tagMDP, keyed by its function names.
+    results = {}
+    state = new_state(entry, **game_options)
+    field = tagMDP.getDistanceField(state)
+    for agent, reward_function, q_value in (("R", tagMDP.rewardFunctionRun, tagMDP.Q_value_Run), ("T", tagMDP.rewardFunctionTag, tagMDP.Q_value_Tag)):
+        results["tagMDP." + reward_function.__name__] = summary(time_calls(lambda: reward_function(state), repeats, field.clear))
+        reward = reward_function(state)
+        times = time_calls(lambda: q_value(state, reward, iterations, tolerance=state.tolerance), repeats)
+        results["tagMDP." + q_value.__name__] = summary(times, sweeps=float(state.sweepReport.sweeps), sweeps_per_second=float(state.sweepReport.sweeps / np.median(times)))
+        q_sa = q_value(state, reward, iterations, tolerance=state.tolerance)
+        results[f"tagMDP.bestAction.{agent}"] = summary(time_calls(lambda: tagMDP.bestAction(state, agent, q_sa, tagMDP.WAIT), repeats, number=100))
+
+    turns = []
+
+    def play():
+        state = new_state(entry, **game_options)
+        tagMDP.Game(state, max_turns, iterations)
+        turns.append(state.TurnCounter)
+
+    times = time_calls(play, max(1, repeats // 2))
+    results["tagMDP.Game"] = summary(times, turns=float(np.mean(turns)), turns_per_second=float(np.sum(turns) / np.sum(times)))
+    return results
+
+
+def run_benchmarks(entries, repeats=5, max_turns=20, iterations=10, progress=None, **game_options):
+    results = {}
+    for entry in entries:
+        size, wall_prob, seed = entry
+        for case, result in bench_entry(entry, repeats, max_turns, iterations, **game_options).items():
+            result.update(case=case, size=size, wall_prob=wall_prob, seed=seed)
+            results[f"{case}/{size}/{wall_prob}"] = result
+        if progress is not None:
+            progress(entry)
+    return {
+        "meta": {
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "repeats": repeats,
+            "max_turns": max_turns,
+            "iterations": iterations,
+            "game_options": game_options,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold=0.25, statistic="p50"):
+    # (key, baseline, current, ratio, regressed) for every case in both runs.
+    rows = []
+    for key in sorted(baseline["results"].keys() & current["results"].keys()):
+        old = baseline["results"][key][statistic]
+        new = current["results"][key][statistic]
+        ratio = new / old if old > 0 else float("inf")
+        rows.append((key, old, new, ratio, ratio > 1 + threshold))
+    return rows
+
+
+def complexity(agent="tagger", sizes=COMPLEXITY_SIZES, iterations=COMPLEXITY_ITERATIONS, repeats=3, wall_prob=0.2, **game_options):
+    # Median seconds of one q_value_update for every (size, iterations) pair,
+    # and the exponents a, b of the least-squares fit
+    # seconds ~ iterations**a * cells**b.
+    rows = []
+    for seed, size in enumerate(sizes):
+        game = new_game((size, wall_prob, seed), 1, 1, **game_options)
+        player = game.runner if agent == "runner" else game.tagger
+        for count in iterations:
+            times = time_calls(lambda: player.q_value_update(count), repeats, lambda: player.q_sa.fill(0))
+            rows.append((size, count, float(np.median(times))))
+    size, count, seconds = (np.array(column, dtype=float) for column in zip(*rows))
+    design = np.stack([np.log(count), np.log(size * size), np.ones(len(rows))], axis=1)
+    (iteration_exponent, cell_exponent, _), *_ = np.linalg.lstsq(design, np.log(seconds), rcond=None)
+    return rows, float(iteration_exponent), float(cell_exponent)
+
+
+def joint_sweeps(sizes=JOINT_SIZES, sweeps=5, repeats=3, wall_prob=0.2):
+    # Median seconds of one JointSolver sweep (with the policy decode spread
+    # over the sweeps) and the number of joint states (2 * free cells**2) it
+    # updates, for every map size.
+    rows = []
+    for seed, size in enumerate(sizes):
+        game = new_game((size, wall_prob, seed), 1, 1)
+        solver = JointSolver(game.game_map.walls)
+        times = time_calls(lambda: solver.solve(horizon=10**6, max_sweeps=sweeps), repeats, lambda: solver.values.fill(0))
+        rows.append((size, 2 * solver.cells.size ** 2, float(np.median(times)) / sweeps))
+    return rows
+
+
+def import_times(module, repeats=5, timeout=60, preload=()):
+    # Seconds each of repeats fresh interpreters took to import module after
+    # importing the preload modules untimed, or None if an import failed or
+    # hung.
+    code = f"import time{''.join(', ' + name for name in preload)}; start_time = time.perf_counter(); import {module}; print(time.perf_counter() - start_time)"
+    times = []
+    for _ in range(repeats):
+        try:
+            done = subprocess.run([sys.executable, "-c", code], stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return None
+        if done.returncode != 0:
+            return None
+        times.append(float(done.stdout.split()[-1]))
+    return times
+
+
+def format_results(results):
+    lines = []
+    for key, result in results["results"].items():
+        line = f'{key}: p50 = {result["p50"] * 1e3:.3f} ms, p90 = {result["p90"] * 1e3:.3f} ms, p99 = {result["p99"] * 1e3:.3f} ms'
+        if "sweeps_per_second" in result:
+            line += f', sweeps per second = {result["sweeps_per_second"]:.1f}'
+        if "turns_per_second" in result:
+            line += f', turns per second = {result["turns_per_second"]:.1f}'
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the tag game hot paths on a fixed map corpus.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="time every case and optionally save a JSON baseline")
+    run.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    run.add_argument("--wall-probs", type=float, nargs="+", default=list(WALL_PROBS))
+    run.add_argument("--repeats", type=int, default=5)
+    run.add_argument("--max-turns", type=int, default=20)
+    run.add_argument("--iterations", type=int, default=10)
+    run.add_argument("--sweep-mode", default="inplace")
+    run.add_argument("--output", help="save the results as JSON")
+    diff = commands.add_parser("compare", help="compare two saved runs and flag regressions")
+    diff.add_argument("baseline")
+    diff.add_argument("current")
+    diff.add_argument("--threshold", type=float, default=0.25, help="flag cases slower by more than this fraction")
+    diff.add_argument("--statistic", default="p50")
+    scaling = commands.add_parser("complexity", help="check that q_value_update stays O(iterations * rows * columns)")
+    scaling.add_argument("--agent", choices=["runner", "tagger"], default="tagger")
+    scaling.add_argument("--sizes", type=int, nargs="+", default=list(COMPLEXITY_SIZES))
+    scaling.add_argument("--iterations", type=int, nargs="+", default=list(COMPLEXITY_ITERATIONS))
+    scaling.add_argument("--repeats", type=int, default=3)
+    scaling.add_argument("--sweep-mode", default="inplace")
+    scaling.add_argument("--max-exponent", type=float, default=1.25, help="fail if either fitted exponent is above this")
+    joint = commands.add_parser("joint", help="check the cost of a JointSolver sweep per joint state")
+    joint.add_argument("--sizes", type=int, nargs="+", default=list(JOINT_SIZES))
+    joint.add_argument("--sweeps", type=int, default=5)
+    joint.add_argument("--repeats", type=int, default=3)
+    joint.add_argument("--max-ns", type=float, default=50, help="fail if a sweep takes longer than this per joint state")
+    startup = commands.add_parser("startup", help="time the import of the game modules in fresh interpreters")
+    startup.add_argument("--modules", nargs="+", default=list(STARTUP_MODULES))
+    startup.add_argument("--repeats", type=int, default=10)
+    startup.add_argument("--max-seconds", type=float, default=0.05, help="fail if an import takes this much longer than numpy's")
+    args = parser.parse_args()
+
+    if args.command == "startup":
+        # The fastest of the repeats: start-up noise only ever adds time. The
+        # game modules are timed with numpy already imported, so what is
+        # compared is their own cost and not the difference of two noisy runs.
+        print(f"numpy: {min(import_times('numpy', args.repeats)) * 1e3:.1f} ms")
+        failures = 0
+        for module in args.modules:
+            times = import_times(module, args.repeats, preload=("numpy",))
+            if times is None:
+                print(f"{module}: FAILED, the import raised or waited for input")
+                failures += 1
+                continue
+            extra = min(times)
+            flag = ""
+            if extra > args.max_seconds:
+                flag = "  REGRESSION"
+                failures += 1
+            print(f"{module}: {extra * 1e3:.1f} ms on top of numpy{flag}")
+        return 1 if failures else 0
+
+    if args.command == "complexity":
+        rows, iteration_exponent, cell_exponent = complexity(args.agent, args.sizes, args.iterations, args.repeats, sweep_mode=args.sweep_mode)
+        for size, count, seconds in rows:
+            print(f"size = {size}, iterations = {count}: {seconds * 1e3:.3f} ms, {seconds / (count * size * size) * 1e9:.2f} ns per cell sweep")
+        print(f"seconds ~ iterations^{iteration_exponent:.2f} * cells^{cell_exponent:.2f}")
+        if max(iteration_exponent, cell_exponent) > args.max_exponent:
+            print(f"REGRESSION: {args.agent}.q_value_update grows faster than O(iterations * rows * columns)")
+            return 1
+        return 0
+
+    if args.command == "joint":
+        failures = 0
+        for size, states, seconds in joint_sweeps(args.sizes, args.sweeps, args.repeats):
+            per_state = seconds / states * 1e9
+            flag = ""
+            if per_state > args.max_ns:
+                flag = "  REGRESSION"
+                failures += 1
+            print(f"size = {size}: {seconds * 1e3:.1f} ms per sweep, {per_state:.2f} ns per joint state{flag}")
+        return 1 if failures else 0
+
+    if args.command == "run":
+        entries = corpus(args.sizes, args.wall_probs)
+        results = run_benchmarks(
+            entries, args.repeats, args.max_turns, args.iterations, sweep_mode=args.sweep_mode,
+            progress=lambda entry: print(f"size = {entry[0]}, wallProbability = {entry[1]} done", file=sys.stderr),
+        )
+        print(format_results(results))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=1)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows = compare(baseline, current, args.threshold, args.statistic)
+    for key, old, new, ratio, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{key}: {old * 1e3:.3f} ms -> {new * 1e3:.3f} ms ({ratio:.2f}x){flag}")
+    regressions = sum(row[4] for row in rows)
+    print(f"{len(rows)} cases compared, {regressions} regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
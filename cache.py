@@ -0,0 +1,78 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+# Content-addressed store of solved Q tables. A key hashes the wall grid
+# together with everything else the solve depends on (agent, positions,
+# solver parameters); values are read-only float32 tables. The memory tier
+# is an LRU bounded by total bytes; with a directory, every table is also
+# written there as <key>.npy and memory misses are served from those files
+# through np.load(mmap_mode="r").
+
+
+def table_key(walls, *parts):
+    walls = np.ascontiguousarray(walls, dtype=bool)
+    digest = hashlib.sha1()
+    digest.update(repr(walls.shape).encode())
+    digest.update(np.packbits(walls).tobytes())
+    digest.update(repr(parts).encode())
+    return digest.hexdigest()
+
+
+class QTableCache:
+    def __init__(self, budget_bytes=64 * 2**20, directory=None):
+        self.budget_bytes = budget_bytes
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.tables = OrderedDict()
+        self.used_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def get(self, key):
+        table = self.tables.get(key)
+        if table is not None:
+            self.tables.move_to_end(key)
+            self.hits += 1
+            return table
+        if self.directory is not None and os.path.exists(self._path(key)):
+            table = np.load(self._path(key), mmap_mode="r")
+            self._remember(key, table)
+            self.disk_hits += 1
+            return table
+        self.misses += 1
+        return None
+
+    def put(self, key, q_sa):
+        table = np.array(q_sa, dtype=np.float32)
+        table.setflags(write=False)
+        if self.directory is not None and not os.path.exists(self._path(key)):
+            # Write under a temporary name first so a crash never leaves a
+            # truncated table behind under the real key.
+            partial = self._path(key + ".partial")
+            with open(partial, "wb") as f:
+                np.save(f, table)
+            os.replace(partial, self._path(key))
+        self._remember(key, table)
+        return table
+
+    def _remember(self, key, table):
+        if key in self.tables:
+            self.used_bytes -= self.tables.pop(key).nbytes
+        if table.nbytes > self.budget_bytes:
+            return
+        self.tables[key] = table
+        self.used_bytes += table.nbytes
+        while self.used_bytes > self.budget_bytes:
+            _, evicted = self.tables.popitem(last=False)
+            self.used_bytes -= evicted.nbytes
+
+    def __len__(self):
+        return len(self.tables)
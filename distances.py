@@ -0,0 +1,167 @@
+from collections import OrderedDict
+
+import numpy as np
+
+# Wall-aware shortest-path distances between the free cells of a map.
+#
+# Distances are found by BFS over the free-cell graph (4-neighbourhood), one
+# source cell at a time, and kept as uint16 rows: a full (free x free) table
+# when it fits in the byte budget, otherwise an LRU of the most recently used
+# rows. Either way each source is searched at most once while it is cached.
+UNREACHABLE = np.iinfo(np.uint16).max
+
+
+def free_cell_graph(walls):
+    # Numbers the free cells of a grid. Returns their flat grid indices, a
+    # flat grid -> cell id lookup (-1 on walls) and a (free cells, 4) table
+    # of the up/down/left/right free neighbours' ids, -1 where that side is
+    # a wall or off the map.
+    shape = walls.shape
+    cells = np.flatnonzero(~walls)
+    cell_ids = np.full(walls.size, -1, dtype=np.int32)
+    cell_ids[cells] = np.arange(cells.size, dtype=np.int32)
+    ids = np.pad(cell_ids.reshape(shape), 1, constant_values=-1)
+    y, x = np.divmod(cells, shape[1])
+    y += 1
+    x += 1
+    neighbours = np.stack([ids[y - 1, x], ids[y + 1, x], ids[y, x - 1], ids[y, x + 1]], axis=1)
+    return cells, cell_ids, neighbours
+
+
+class DistanceField:
+    def __init__(self, walls, budget_bytes=32 * 2**20):
+        self.walls = np.array(walls, dtype=bool)
+        self.shape = self.walls.shape
+        self.cells, self.cell_ids, self.neighbours = free_cell_graph(self.walls)
+
+        row_bytes = max(self.cells.size, 1) * np.dtype(np.uint16).itemsize
+        if self.cells.size * row_bytes <= budget_bytes:
+            self.table = np.empty((self.cells.size, self.cells.size), dtype=np.uint16)
+            self.filled = np.zeros(self.cells.size, dtype=bool)
+        else:
+            self.table = None
+            self.rows = OrderedDict()
+            self.capacity = max(1, budget_bytes // row_bytes)
+
+    def clear(self):
+        # Forgets every row searched so far.
+        if self.table is not None:
+            self.filled[:] = False
+        else:
+            self.rows.clear()
+
+    def cell_id(self, y, x):
+        return int(self.cell_ids[y * self.shape[1] + x])
+
+    def _bfs(self, source):
+        distance = np.full(self.cells.size, UNREACHABLE, dtype=np.uint16)
+        distance[source] = 0
+        frontier = np.array([source])
+        step = 0
+        while frontier.size:
+            step = min(step + 1, UNREACHABLE - 1)
+            reached = self.neighbours[frontier].ravel()
+            reached = reached[reached >= 0]
+            reached = np.unique(reached[distance[reached] == UNREACHABLE])
+            distance[reached] = step
+            frontier = reached
+        return distance
+
+    def from_cell(self, source):
+        # Distances from free cell id source to every free cell id.
+        if self.table is not None:
+            if not self.filled[source]:
+                self.table[source] = self._bfs(source)
+                self.filled[source] = True
+            return self.table[source]
+        row = self.rows.get(source)
+        if row is None:
+            row = self._bfs(source)
+            self.rows[source] = row
+            if len(self.rows) > self.capacity:
+                self.rows.popitem(last=False)
+        else:
+            self.rows.move_to_end(source)
+        return row
+
+    def distance(self, a, b):
+        source, target = self.cell_id(*a), self.cell_id(*b)
+        if source < 0 or target < 0:
+            return int(UNREACHABLE)
+        return int(self.from_cell(source)[target])
+
+    def grid(self, y, x):
+        # (rows, columns) uint16 distances from (y, x); walls and cells that
+        # cannot be reached are UNREACHABLE.
+        out = np.full(self.walls.size, UNREACHABLE, dtype=np.uint16)
+        source = self.cell_id(y, x)
+        if source >= 0:
+            out[self.cells] = self.from_cell(source)
+        return out.reshape(self.shape)
+
+
+def wavefront_distances(walls, sources):
+    # Distances from one source cell per grid, for a stack of grids at once:
+    # walls is (..., rows, columns) and sources (..., 2). The BFS frontier of
+    # every grid grows by one step per iteration through shifted boolean masks.
+    walls = np.asarray(walls, dtype=bool)
+    sources = np.asarray(sources)
+    if walls.ndim == 2:
+        return wavefront_distances(walls[np.newaxis], sources[np.newaxis])[0]
+    distance = np.full(walls.shape, UNREACHABLE, dtype=np.uint16)
+    frontier = np.zeros(walls.shape, dtype=bool)
+    batch = np.indices(walls.shape[:-2]).reshape(len(walls.shape) - 2, -1)
+    source_index = (*batch, sources[..., 0].ravel(), sources[..., 1].ravel())
+    frontier[source_index] = True
+    distance[source_index] = 0
+    unvisited = ~walls
+    unvisited[source_index] = False
+    grown = np.empty_like(frontier)
+    step = 0
+    while frontier.any():
+        step = min(step + 1, UNREACHABLE - 1)
+        grown[...] = False
+        grown[..., 1:, :] |= frontier[..., :-1, :]
+        grown[..., :-1, :] |= frontier[..., 1:, :]
+        grown[..., 1:] |= frontier[..., :-1]
+        grown[..., :-1] |= frontier[..., 1:]
+        grown &= unvisited
+        np.copyto(distance, step, where=grown)
+        unvisited ^= grown
+        frontier, grown = grown, frontier
+    return distance
+
+
+def label_components(walls):
+    # Connected components of the free cells (4-neighbourhood). Returns a
+    # grid of labels 0 .. count - 1 (-1 on walls) and count, numbered in the
+    # order of each component's first cell. The nodes are the horizontal runs
+    # of free cells and the edges link runs that touch vertically. Every run
+    # points at a smaller or equal run id; each pass hooks the larger root of
+    # every edge onto the smaller one, jumps pointers until each run points
+    # straight at its root and drops the edges inside a tree. A handful of
+    # vectorized passes suffice even on large maps.
+    walls = np.asarray(walls, dtype=bool)
+    free = ~walls
+    starts = free.copy()
+    starts[:, 1:] &= walls[:, :-1]
+    run = np.cumsum(starts.ravel(), dtype=np.int32) - 1
+    touching = np.flatnonzero(free[:-1] & free[1:])
+    upper, lower = run[touching], run[touching + walls.shape[1]]
+    parent = np.arange(run[-1] + 1 if run.size else 0, dtype=np.int32)
+    while upper.size:
+        upper, lower = parent[upper], parent[lower]
+        linked = upper != lower
+        upper, lower = upper[linked], lower[linked]
+        np.minimum.at(parent, np.maximum(upper, lower), np.minimum(upper, lower))
+        while True:
+            jumped = parent[parent]
+            if np.array_equal(jumped, parent):
+                break
+            parent = jumped
+    roots = parent == np.arange(parent.size)
+    labels = np.cumsum(roots, dtype=np.int32) - 1
+    grid = np.full(walls.size, -1, dtype=np.int32)
+    free = free.ravel()
+    grid[free] = labels[parent][run[free]]
+    return grid.reshape(walls.shape), int(roots.sum())
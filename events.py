@@ -0,0 +1,129 @@
+import json
+
+import numpy as np
+
+# Event sinks for the game loops. A game reports three kinds of events:
+#   action(agent, kind, move, turn, q)  - kind is "awaiting", "exploration",
+#                                         "best" or "human" (a move sent by a
+#                                         player, see server.py)
+#   turn(turn, positions, render)       - after a move; render() returns the
+#                                         character map and is only called by
+#                                         sinks that display it
+#   result(winner, turns)               - 1 if the Runner survived, -1 if tagged
+# All formatting happens inside the sinks, so a NullSink costs one no-op call
+# per event.
+AGENTS = ("R", "T")
+ACTION_KINDS = ("awaiting", "exploration", "best", "result", "human")
+MOVES = ("up", "down", "left", "right")
+
+# One record per turn, plus a final record with kind "result" whose move field
+# holds the winner. move is -1 for a waiting move.
+TURN_DTYPE = np.dtype([
+    ("turn", np.int32),
+    ("agent", np.int8),
+    ("kind", np.int8),
+    ("move", np.int8),
+    ("q", np.float32),
+    ("runner_y", np.int16),
+    ("runner_x", np.int16),
+    ("tagger_y", np.int16),
+    ("tagger_x", np.int16),
+])
+
+
+class NullSink:
+    def action(self, agent, kind, move, turn, q=None):
+        pass
+
+    def turn(self, turn, positions, render):
+        pass
+
+    def result(self, winner, turns):
+        pass
+
+    def close(self):
+        pass
+
+
+class ConsoleSink(NullSink):
+    # Prints the same lines the games used to print themselves.
+    def action(self, agent, kind, move, turn, q=None):
+        if kind == "best":
+            print(f'The agent {agent} has chosen the best move: {move}, Turn = {turn}, Q_sa = {q:.3f}')
+        else:
+            description = {"exploration": "random exploration", "human": "human"}.get(kind, "awaiting")
+            print(f'The agent {agent} has chosen a {description} move: {move}, Turn = {turn}')
+
+    def turn(self, turn, positions, render):
+        rows = render()
+        print("-" * (len(rows[0]) * 2))
+        if turn > 0:
+            for row in rows:
+                print(' '.join(row))
+
+    def result(self, winner, turns):
+        print("Player Run has won the game!" if winner == 1 else "Player Tag has won the game!")
+
+
+class BufferedSink(NullSink):
+    # Collects compact turn records and writes them in bulk, either as raw
+    # TURN_DTYPE records ("binary") or as JSON lines ("jsonl").
+    def __init__(self, path, format="jsonl", buffer_size=4096):
+        if format not in ("jsonl", "binary"):
+            raise ValueError(f"Unknown record format {format!r}")
+        self.format = format
+        self.buffer_size = buffer_size
+        self.file = open(path, "ab" if format == "binary" else "a")
+        self.records = []
+        self.pending = None
+
+    def action(self, agent, kind, move, turn, q=None):
+        self.pending = (agent, kind, move, q)
+
+    def turn(self, turn, positions, render):
+        agent, kind, move, q = self.pending or (None, "awaiting", None, None)
+        self.pending = None
+        self.records.append((
+            turn,
+            AGENTS.index(agent) if agent in AGENTS else -1,
+            ACTION_KINDS.index(kind),
+            MOVES.index(move) if move in MOVES else -1,
+            np.nan if q is None else q,
+            *positions["R"],
+            *positions["T"],
+        ))
+        if len(self.records) >= self.buffer_size:
+            self.flush()
+
+    def result(self, winner, turns):
+        self.records.append((turns, -1, ACTION_KINDS.index("result"), winner, np.nan, -1, -1, -1, -1))
+        self.flush()
+
+    def flush(self):
+        if not self.records:
+            return
+        if self.format == "binary":
+            np.array(self.records, dtype=TURN_DTYPE).tofile(self.file)
+        else:
+            names = TURN_DTYPE.names
+            lines = []
+            for record in self.records:
+                fields = dict(zip(names, record))
+                fields["agent"] = AGENTS[fields["agent"]] if fields["agent"] >= 0 else None
+                fields["kind"] = ACTION_KINDS[fields["kind"]]
+                if fields["kind"] != "result":
+                    fields["move"] = MOVES[fields["move"]] if fields["move"] >= 0 else None
+                fields["q"] = None if np.isnan(fields["q"]) else float(fields["q"])
+                lines.append(json.dumps(fields) + "\n")
+            self.file.writelines(lines)
+        self.file.flush()
+        self.records = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def read_records(path):
+    # Reads back a binary BufferedSink file.
+    return np.fromfile(path, dtype=TURN_DTYPE)
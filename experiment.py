@@ -0,0 +1,145 @@
+import hashlib
+import itertools
+import os
+import time
+from functools import partial
+
+import numpy as np
+
+from results import ResultStream, load_results
+from tagmdp_2 import Game
+
+# Headless batch runs of tagmdp_2.Game. A configuration is a tuple
+# (map_size, wall_prob, z, max_turns, seed); every game draws all of its
+# randomness from SeedSequence(seed), so results do not depend on which worker
+# played it and any game can be replayed exactly.
+#
+# With --stream DIR the rows are written to DIR in chunks as they finish
+# (results.ResultStream) and a killed run picks up after its last chunk
+# when started again with the same arguments.
+RESULT_DTYPE = np.dtype([
+    ("map_size", np.int32),
+    ("wall_prob", np.float64),
+    ("z", np.int32),
+    ("max_turns", np.int32),
+    ("seed", np.int64),
+    ("winner", np.int8),  # 1: Runner survived, -1: Tagger won
+    ("turns", np.int32),
+    ("elapsed", np.float64),
+])
+
+
+def config_grid(map_sizes, wall_probs, zs, max_turns, seeds):
+    return list(itertools.product(map_sizes, wall_probs, zs, max_turns, seeds))
+
+
+def play_game(config, **game_options):
+    map_size, wall_prob, z, max_turns, seed = config
+    game = Game(max_turns, z, map_size, map_size, wall_prob, rng=np.random.SeedSequence(seed), **game_options)
+    start_time = time.perf_counter()
+    winner = game.run()
+    elapsed_time = time.perf_counter() - start_time
+    return (map_size, wall_prob, z, max_turns, seed, winner, game.turn_counter, elapsed_time)
+
+
+def run_experiment(configs, workers=None, chunksize=None, pool=None, **game_options):
+    # Plays every configuration and returns a RESULT_DTYPE structured array
+    # in the same order. workers=1 plays in this process; pool reuses an
+    # executor instead of starting one. The process pool (like argparse in
+    # main) is only imported when used: worker processes import this module
+    # and concurrent.futures.process alone roughly doubles its import time.
+    from concurrent.futures import ProcessPoolExecutor
+
+    configs = list(configs)
+    play = partial(play_game, **game_options)
+    if workers == 1:
+        results = [play(config) for config in configs]
+    else:
+        workers = workers or os.cpu_count() or 1
+        if chunksize is None:
+            chunksize = max(1, len(configs) // (workers * 4))
+        if pool is None:
+            with ProcessPoolExecutor(workers) as pool:
+                results = list(pool.map(play, configs, chunksize=chunksize))
+        else:
+            results = list(pool.map(play, configs, chunksize=chunksize))
+    return np.array(results, dtype=RESULT_DTYPE)
+
+
+def stream_experiment(configs, directory, workers=None, chunk_size=256, **game_options):
+    # run_experiment in chunks of chunk_size games, each appended to
+    # directory and checkpointed once played. A rerun over the same
+    # configurations skips the games already checkpointed; games are seeded,
+    # so the rows are the same as those of an uninterrupted run.
+    configs = list(configs)
+    digest = hashlib.sha1(repr((configs, sorted(game_options.items()))).encode()).hexdigest()
+    stream = ResultStream(directory, RESULT_DTYPE, chunk_size)
+    state = stream.resume()
+    if state is not None and state["configs"] != digest:
+        raise ValueError(f"{directory} holds results of a different experiment")
+    done = 0 if state is None else state["games"]
+    from concurrent.futures import ProcessPoolExecutor
+
+    pool = None if workers == 1 else ProcessPoolExecutor(workers or os.cpu_count() or 1)
+    try:
+        with stream:
+            for start in range(done, len(configs), chunk_size):
+                for row in run_experiment(configs[start:start + chunk_size], workers, pool=pool, **game_options):
+                    stream.append(row)
+                stream.checkpoint({"configs": digest, "games": min(start + chunk_size, len(configs))})
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return load_results(directory)
+
+
+def summarize(results):
+    # One row per configuration with the Runner's win rate over its seeds.
+    keys = ["map_size", "wall_prob", "z", "max_turns"]
+    lines = []
+    for key in np.unique(results[keys]):
+        games = results[results[keys] == key]
+        win_rate = np.mean(games["winner"] == 1)
+        lines.append(
+            f'size = {key["map_size"]}, wallProbability = {key["wall_prob"]}, z = {key["z"]}, maxTurns = {key["max_turns"]}: '
+            f'games = {len(games)}, runner win rate = {win_rate:.3f}, mean turns = {games["turns"].mean():.1f}, '
+            f'mean time = {games["elapsed"].mean():.3f} s'
+        )
+    return "\n".join(lines)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Play a grid of headless tag games in parallel.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[11])
+    parser.add_argument("--wall-probs", type=float, nargs="+", default=[0.2])
+    parser.add_argument("--z", type=int, nargs="+", default=[10])
+    parser.add_argument("--max-turns", type=int, nargs="+", default=[75])
+    parser.add_argument("--games", type=int, default=100, help="games (seeds) per configuration")
+    parser.add_argument("--seed", type=int, default=0, help="first seed")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--sweep-mode", default="inplace")
+    parser.add_argument("--connected", action="store_true", help="wall off pockets the agents could not reach")
+    parser.add_argument("--output", help="save the results table as .npy")
+    parser.add_argument("--stream", metavar="DIR", help="write results to DIR in chunks and resume from it")
+    parser.add_argument("--chunk-size", type=int, default=256, help="games per streamed chunk")
+    args = parser.parse_args()
+
+    seeds = range(args.seed, args.seed + args.games)
+    configs = config_grid(args.sizes, args.wall_probs, args.z, args.max_turns, seeds)
+    start_time = time.time()
+    game_options = dict(sweep_mode=args.sweep_mode, connected=args.connected)
+    if args.stream:
+        results = stream_experiment(configs, args.stream, workers=args.workers, chunk_size=args.chunk_size, **game_options)
+    else:
+        results = run_experiment(configs, workers=args.workers, **game_options)
+    elapsed_time = time.time() - start_time
+    print(summarize(results))
+    print(f'Elapsed time: {elapsed_time:.3f} seconds, games = {len(results)}, games per second = {len(results) / elapsed_time:.1f}')
+    if args.output:
+        np.save(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
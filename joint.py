@@ -0,0 +1,140 @@
+import numpy as np
+
+from bellman import SweepReport
+from distances import free_cell_graph
+from moves import REVERSE, WAIT
+
+# Offline minimax solver over the joint state (runner cell, tagger cell, whose
+# turn). Values count the turns the Runner still survives: the Runner picks
+# the move that maximizes it, the Tagger the one that minimizes it, a tag
+# (agents on adjacent cells) is worth 0 and values are capped at the horizon.
+#
+# States are indexed by free cell ids only and stored as float32
+# (free cells x free cells) tables, one per side to move. Every cell has at
+# most four successors, so one sweep is four gathers through a padded
+# successor table reduced in place with np.maximum / np.minimum, done in row
+# blocks of bounded size.
+RUNNER, TAGGER = 0, 1
+
+
+class JointSolver:
+    def __init__(self, walls, block_bytes=16 * 2**20):
+        self.walls = np.array(walls, dtype=bool)
+        self.shape = self.walls.shape
+        self.cells, self.cell_ids, self.neighbours = free_cell_graph(self.walls)
+        count = self.cells.size
+
+        # (4, free cells) successors: the free neighbours of a cell, padded
+        # with its first one (which leaves a max or min unchanged), or the
+        # cell itself when it has none.
+        valid = self.neighbours >= 0
+        first = np.where(valid.any(axis=1), self.neighbours[np.arange(count), valid.argmax(axis=1)], np.arange(count))
+        self.successors = np.ascontiguousarray(np.where(valid, self.neighbours, first[:, np.newaxis]).T)
+
+        self.terminal = np.eye(count, dtype=bool)
+        rows = np.repeat(np.arange(count), valid.sum(axis=1))
+        self.terminal[rows, self.neighbours[valid]] = True
+        self.values = np.zeros((2, count, count), dtype=np.float32)
+        self.policy = np.full((2, count, count), WAIT, dtype=np.int8)
+        self.block = max(1, block_bytes // max(count * 4, 1))
+        self.scratch = np.empty((min(self.block, count), count), dtype=np.float32)
+
+    def _reduce_successors(self, values, ufunc, axis, out):
+        # axis 0: out[c, :] = ufunc over the successors s of c of values[s, :]
+        # axis 1: out[:, c] = ufunc over the successors s of c of values[:, s]
+        for start in range(0, values.shape[0], self.block):
+            rows = slice(start, start + self.block)
+            target = out[rows]
+            scratch = self.scratch[:target.shape[0]]
+            for k, successors in enumerate(self.successors):
+                if axis == 0:
+                    np.take(values, successors[rows], axis=0, out=target if k == 0 else scratch)
+                else:
+                    np.take(values[rows], successors, axis=1, out=target if k == 0 else scratch)
+                if k:
+                    ufunc(target, scratch, out=target)
+        return out
+
+    def solve(self, horizon, max_sweeps=None):
+        # Value iteration until neither table changes (at most horizon + 1
+        # sweeps, since every value is a turn count capped at horizon).
+        runner_values, tagger_values = self.values
+        max_sweeps = horizon + 1 if max_sweeps is None else max_sweeps
+        new_runner = np.empty_like(runner_values)
+        new_tagger = np.empty_like(tagger_values)
+        residual = np.inf
+        for sweep in range(1, max_sweeps + 1):
+            self._finish(self._reduce_successors(tagger_values, np.maximum, 0, new_runner), horizon)
+            self._finish(self._reduce_successors(new_runner, np.minimum, 1, new_tagger), horizon)
+            residual = max(_max_change(runner_values, new_runner), _max_change(tagger_values, new_tagger))
+            if residual == 0:
+                break
+        self._decode_policy()
+        return SweepReport(sweep, residual, residual == 0)
+
+    def _finish(self, values, horizon):
+        values += 1
+        np.minimum(values, horizon, out=values)
+        np.copyto(values, 0, where=self.terminal)
+        return values
+
+    def _decode_policy(self):
+        # policy[mover, r, t]: the first of up/down/left/right with the best
+        # value for the mover, or WAIT when the mover's cell has no free
+        # neighbour. Built like a sweep, one direction at a time.
+        runner_values, tagger_values = self.values
+        best = np.empty((min(self.block, self.cells.size), self.cells.size), dtype=np.float32)
+        for start in range(0, self.cells.size, self.block):
+            rows = slice(start, min(start + self.block, self.cells.size))
+            count = rows.stop - start
+            for mover, better in ((RUNNER, np.greater), (TAGGER, np.less)):
+                actions = self.policy[mover, rows]
+                actions[...] = WAIT
+                for direction, neighbours in enumerate(self.neighbours.T):
+                    if mover == RUNNER:
+                        values = tagger_values[np.maximum(neighbours[rows], 0)]
+                        free = (neighbours[rows] >= 0)[:, np.newaxis]
+                    else:
+                        values = runner_values[rows][:, np.maximum(neighbours, 0)]
+                        free = neighbours >= 0
+                    improved = free & ((actions == WAIT) | better(values, best[:count]))
+                    np.copyto(best[:count], values, where=improved)
+                    actions[improved] = direction
+
+    def cell_id(self, y, x):
+        return int(self.cell_ids[y * self.shape[1] + x])
+
+    def action(self, mover, runner, tagger, previous=WAIT):
+        # Best action index (up, down, left, right) for the mover, or WAIT to
+        # stay. The table answer is used unless it reverses the previous
+        # action; then the other moves are compared directly.
+        r, t = self.cell_id(*runner), self.cell_id(*tagger)
+        action = int(self.policy[mover, r, t])
+        forbidden = REVERSE[previous]
+        if action != forbidden:
+            return action
+        own = r if mover == RUNNER else t
+        best, best_value = WAIT, None
+        for candidate, cell in enumerate(self.neighbours[own]):
+            if cell < 0 or candidate == forbidden:
+                continue
+            if mover == RUNNER:
+                value = self.values[TAGGER, cell, t]
+                better = best_value is None or value > best_value
+            else:
+                value = self.values[RUNNER, r, cell]
+                better = best_value is None or value < best_value
+            if better:
+                best, best_value = candidate, value
+        return best
+
+    def value(self, mover, runner, tagger):
+        return float(self.values[mover, self.cell_id(*runner), self.cell_id(*tagger)])
+
+
+def _max_change(values, new):
+    # Largest |new - values| (values are finite), then values takes new.
+    values -= new
+    change = float(max(values.max(), -values.min()))
+    np.copyto(values, new)
+    return change
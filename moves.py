@@ -0,0 +1,65 @@
+import numpy as np
+
+from distances import free_cell_graph
+
+# Integer actions and per-cell move tables. An action is an index into
+# ACTIONS, or WAIT. For every free cell a MoveTable holds the free cell id and
+# the flat grid index each action leads to (-1 when blocked by a wall or the
+# edge of the map) and a 4-bit mask of the actions that are not blocked.
+# Combined with ALLOWED, the actions that do not reverse the previous one,
+# the legal moves of an agent are one lookup and its greedy action a scan of
+# at most four Q values. The per-cell rows are also kept as lists: at four
+# values a Python scan beats the fixed cost of numpy calls several times over.
+ACTIONS = ("up", "down", "left", "right")
+WAIT = -1
+REVERSE = np.array([1, 0, 3, 2, -2])  # REVERSE[WAIT] matches nothing
+# ALLOWED[previous]: bitmask of the actions allowed after previous.
+ALLOWED = np.array([0b1111 & ~(1 << int(r)) if r >= 0 else 0b1111 for r in REVERSE], dtype=np.uint8)
+# MASK_ACTIONS[mask]: the actions in a 4-bit mask, in ACTIONS order.
+MASK_ACTIONS = tuple(tuple(a for a in range(len(ACTIONS)) if mask >> a & 1) for mask in range(16))
+_ALLOWED = ALLOWED.tolist()
+
+
+def action_index(action):
+    # ACTIONS index of a move name; None (waiting) is WAIT.
+    return WAIT if action is None else ACTIONS.index(action)
+
+
+def action_name(action):
+    return None if action == WAIT else ACTIONS[action]
+
+
+class MoveTable:
+    def __init__(self, walls):
+        walls = np.asarray(walls, dtype=bool)
+        self.shape = walls.shape
+        self.cells, self.cell_ids, self.neighbours = free_cell_graph(walls)
+        self.neighbours = self.neighbours.astype(np.int32)
+        blocked = self.neighbours < 0
+        self.targets = np.where(blocked, -1, self.cells[self.neighbours]).astype(np.int32)
+        self.valid = (~blocked @ (1 << np.arange(len(ACTIONS)))).astype(np.uint8)
+        self._targets = self.targets.tolist()
+        self._valid = self.valid.tolist()
+
+    def cell(self, y, x):
+        return int(self.cell_ids[y * self.shape[1] + x])
+
+    def options(self, cell, previous=WAIT):
+        # The actions an agent on cell may take after previous, as a tuple.
+        return MASK_ACTIONS[self._valid[cell] & _ALLOWED[previous]]
+
+    def position(self, cell, action):
+        return divmod(self._targets[cell][action], self.shape[1])
+
+    def greedy(self, q_sa, cell, options, floor=-np.inf, last=False):
+        # (action, value) of the option leading to the highest Q value above
+        # floor, ties to the first option (the last with last=True);
+        # (WAIT, floor) when there is none.
+        flat = q_sa.ravel()
+        targets = self._targets[cell]
+        action, top = WAIT, floor
+        for option in options:
+            value = flat[targets[option]]
+            if value > top or last and value == top:
+                action, top = option, value
+        return action, top
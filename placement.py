@@ -0,0 +1,138 @@
+import numpy as np
+
+from distances import label_components
+
+# Agent placement on a wall grid without retry loops. The Tagger has to
+# start more than 2 rows and more than 2 columns away from the Runner (the
+# rule of the original placement loop), and both start on free interior
+# cells of the same connected component, so the Tagger can always reach the
+# Runner. Positions are drawn from the exact set of valid cells, which is
+# computed with array operations.
+MIN_OFFSET = 3
+
+
+def fill_pockets(walls):
+    # Walls off every free cell outside the largest connected component, in
+    # place, so that all free cells of the map are connected. Returns the
+    # component labels of the filled walls (as label_components does), which
+    # place_agents can reuse.
+    labels, count = label_components(walls)
+    if count > 1:
+        sizes = np.bincount(labels[labels >= 0], minlength=count)
+        pockets = (labels >= 0) & (labels != sizes.argmax())
+        walls[pockets] = True
+        labels = np.where(walls, -1, 0).astype(np.int32)
+        count = 1
+    return labels, count
+
+
+def far_coordinate(runner, size, rng):
+    # Uniform draw from 1 .. size-2 excluding runner-2 .. runner+2, without
+    # rejection sampling.
+    low = np.maximum(runner - (MIN_OFFSET - 1), 1)
+    width = np.minimum(runner + (MIN_OFFSET - 1), size - 2) - low + 1
+    choices = size - 2 - width
+    if (choices <= 0).any():
+        raise ValueError(f"A map of size {size} has no room for the Tagger at distance > 2 from the Runner")
+    coordinate = 1 + (rng.random(runner.shape) * choices).astype(int)
+    return np.where(coordinate >= low, coordinate + width, coordinate)
+
+
+def _running_extremes(low, high, segments, span, reverse=False):
+    # Running min of low and max of high (both sorted by segment, all values
+    # in 0 .. span - 1) that restart at every new segment: the values are
+    # offset by span per segment so that one accumulate does it. reverse
+    # runs them from the end.
+    step = slice(None, None, -1 if reverse else 1)
+    offset = segments[step].astype(np.int64) * (-span if reverse else span)
+    low = np.minimum.accumulate(low[step] - offset) + offset
+    high = np.maximum.accumulate(high[step] + offset) - offset
+    return low[step], high[step]
+
+
+def tagger_choices(walls, components=None):
+    # (y, x, labels, far) of the free interior cells, far telling whether any
+    # cell of the same component is far enough away for the Tagger.
+    # components are the walls' label_components, if already known. Such a
+    # cell lies at least MIN_OFFSET rows above or below, and then is far
+    # enough if that row range of the component reaches MIN_OFFSET columns to
+    # either side. The cells are grouped per (component, row) and the running
+    # column extremes of the groups above and below a cell are looked up by
+    # binary search, so memory stays linear in the cells however many
+    # components the walls make.
+    labels, count = label_components(walls) if components is None else components
+    labels = labels.copy()
+    labels[[0, -1], :] = -1
+    labels[:, [0, -1]] = -1
+    # Single-cell components can never hold both agents. The extra last
+    # size (0) is the one label -1 picks up.
+    sizes = np.bincount(labels[labels >= 0], minlength=count + 1)
+    labels[sizes[labels] < 2] = -1
+    num_rows, num_columns = labels.shape
+    y, x = np.nonzero(labels >= 0)
+    cell_labels = labels[y, x]
+    if y.size == 0:
+        return y, x, cell_labels, np.zeros(0, dtype=bool)
+    # Stable, so the cells stay in row order within every component.
+    order = np.argsort(cell_labels, kind="stable")
+    keys = cell_labels[order].astype(np.int64) * num_rows + y[order]
+    new_group = np.diff(keys, prepend=-1) != 0
+    starts = np.flatnonzero(new_group)
+    group = np.empty(keys.size, dtype=np.intp)
+    group[order] = np.cumsum(new_group) - 1
+    group_keys = keys[starts]
+    group_labels = group_keys // num_rows
+    columns = x[order]
+    low = np.minimum.reduceat(columns, starts)
+    high = np.maximum.reduceat(columns, starts)
+    # The column range of the component MIN_OFFSET or more rows above or
+    # below every group, empty (num_columns .. -1) where it has no such row.
+    reach_low = np.full(starts.size, num_columns)
+    reach_high = np.full(starts.size, -1)
+    for reverse in (False, True):
+        running_low, running_high = _running_extremes(low, high, group_labels, num_columns + 1, reverse)
+        if reverse:
+            other = np.searchsorted(group_keys, group_keys + MIN_OFFSET, side="left")
+        else:
+            other = np.searchsorted(group_keys, group_keys - MIN_OFFSET, side="right") - 1
+        found = (other >= 0) & (other < starts.size)
+        other = np.clip(other, 0, starts.size - 1)
+        found &= group_labels[other] == group_labels
+        reach_low = np.where(found, np.minimum(reach_low, running_low[other]), reach_low)
+        reach_high = np.where(found, np.maximum(reach_high, running_high[other]), reach_high)
+    far = (x >= reach_low[group] + MIN_OFFSET) | (x <= reach_high[group] - MIN_OFFSET)
+    return y, x, cell_labels, far
+
+
+def place_agents(walls, rng, components=None):
+    # Returns the Runner's and the Tagger's (row, column). The Runner is
+    # uniform over the cells that have at least one valid Tagger cell and the
+    # Tagger uniform over those. If the walls allow no such pair, the Runner
+    # starts on a free cell of the largest component (anywhere inside when
+    # there is none), the Tagger far enough away by the old rule, and the
+    # walls on an L-shaped path between them are cleared (walls is changed
+    # in place), so the Tagger can still reach the Runner and a connected
+    # map stays connected. A map too small for any placement raises
+    # ValueError. components are the walls' label_components (such as
+    # fill_pockets returns), if already known.
+    y, x, labels, far = tagger_choices(walls, components)
+    candidates = np.flatnonzero(far)
+    if candidates.size:
+        runner = candidates[rng.integers(candidates.size)]
+        r_row, r_col = int(y[runner]), int(x[runner])
+        valid = (labels == labels[runner]) & (np.abs(y - r_row) >= MIN_OFFSET) & (np.abs(x - r_col) >= MIN_OFFSET)
+        taggers = np.flatnonzero(valid)
+        tagger = taggers[rng.integers(taggers.size)]
+        return (r_row, r_col), (int(y[tagger]), int(x[tagger]))
+    num_rows, num_columns = walls.shape
+    if labels.size:
+        largest = np.flatnonzero(labels == np.bincount(labels).argmax())
+        runner = largest[rng.integers(largest.size)]
+        r_row, r_col = int(y[runner]), int(x[runner])
+    else:
+        r_row, r_col = int(rng.integers(1, num_rows - 1)), int(rng.integers(1, num_columns - 1))
+    t_row = int(far_coordinate(np.array(r_row), num_rows, rng))
+    t_col = int(far_coordinate(np.array(r_col), num_columns, rng))
+    walls[r_row, min(r_col, t_col):max(r_col, t_col) + 1] = False
+    walls[min(r_row, t_row):max(r_row, t_row) + 1, t_col] = False
+    return (r_row, r_col), (t_row, t_col)
@@ -0,0 +1,141 @@
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+import numpy as np
+
+# Opt-in instrumentation of a game: seconds spent per phase, sweep and
+# find_agent_location counts, and the peak memory of the Q-table solve, both
+# as running totals and as one trace row per turn.
+#
+# Games take a GameStats (Game(..., stats=GameStats()) in tagmdp_2,
+# GameState(gameStats=GameStats()) in tagMDP) and wrap their phases in
+# `with game.phase(name):`. Without one, phase() hands out NO_PHASE, a shared
+# nullcontext, so the uninstrumented cost is one attribute check per phase.
+PHASES = ("reward", "sweeps", "action", "move", "render")
+NO_PHASE = nullcontext()
+
+TRACE_DTYPE = np.dtype(
+    [("turn", np.int32), ("agent", "U1")]
+    + [(phase + "_seconds", np.float64) for phase in PHASES]
+    + [
+        ("sweeps", np.int32),
+        ("residual", np.float64),
+        ("find_agent_location_calls", np.int64),
+        ("q_peak_bytes", np.int64),  # Q table + solver working memory, -1 when not traced
+    ]
+)
+
+
+class PhaseTimer:
+    __slots__ = ("stats", "name", "probe", "start_time", "start_bytes")
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+        # Only the solve is probed for memory.
+        self.probe = stats.trace_memory and name == "sweeps"
+
+    def __enter__(self):
+        if self.probe:
+            tracemalloc.reset_peak()
+            self.start_bytes = tracemalloc.get_traced_memory()[0]
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed_time = time.perf_counter() - self.start_time
+        self.stats.seconds[self.name] += elapsed_time
+        self.stats.calls[self.name] += 1
+        if self.stats.current is not None:
+            self.stats.current[self.name + "_seconds"] += elapsed_time
+        if self.probe:
+            self.stats.probe_bytes = max(self.stats.probe_bytes, tracemalloc.get_traced_memory()[1] - self.start_bytes)
+        return False
+
+
+class GameStats:
+    def __init__(self, trace_memory=False):
+        # trace_memory measures allocations with tracemalloc, which slows
+        # every allocation down; leave it off when only timing.
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.timers = {phase: PhaseTimer(self, phase) for phase in PHASES}
+        self.turns = 0
+        self.sweeps = 0
+        self.find_agent_location_calls = 0
+        self.q_peak_bytes = 0
+        self.probe_bytes = 0
+        self.rows = []
+        self.current = None
+        self._calls_at_turn_start = 0
+
+    def phase(self, name):
+        return self.timers[name]
+
+    def count_calls(self, game_map):
+        # Counts find_agent_location calls on this map by wrapping the
+        # method on the instance only; uninstrumented maps are not touched.
+        find = game_map.find_agent_location
+
+        def find_agent_location(agent):
+            self.find_agent_location_calls += 1
+            return find(agent)
+
+        game_map.find_agent_location = find_agent_location
+
+    def begin_turn(self, turn, agent):
+        self.current = {"turn": turn, "agent": agent}
+        self.current.update((phase + "_seconds", 0.0) for phase in PHASES)
+        self._calls_at_turn_start = self.find_agent_location_calls
+        self.probe_bytes = 0
+
+    def end_turn(self, report=None, q_sa=None):
+        # report is the turn's SweepReport (None when nothing was swept) and
+        # q_sa the table it solved, counted in the memory peak.
+        row = self.current
+        row["sweeps"] = 0 if report is None else report.sweeps
+        row["residual"] = np.nan if report is None else report.residual
+        row["find_agent_location_calls"] = self.find_agent_location_calls - self._calls_at_turn_start
+        row["q_peak_bytes"] = -1
+        if self.trace_memory:
+            row["q_peak_bytes"] = self.probe_bytes + (0 if q_sa is None else q_sa.nbytes)
+            self.q_peak_bytes = max(self.q_peak_bytes, row["q_peak_bytes"])
+        self.turns += 1
+        self.sweeps += row["sweeps"]
+        self.rows.append(tuple(row[name] for name in TRACE_DTYPE.names))
+        self.current = None
+
+    def trace(self):
+        return np.array(self.rows, dtype=TRACE_DTYPE)
+
+    def save_trace(self, path):
+        # .csv writes a header line and one line per turn; anything else is
+        # saved as a .npy structured array.
+        trace = self.trace()
+        if str(path).endswith(".csv"):
+            np.savetxt(path, trace, fmt="%s", delimiter=",", header=",".join(TRACE_DTYPE.names), comments="")
+        else:
+            np.save(path, trace)
+
+    def summary(self):
+        return {
+            "turns": self.turns,
+            "seconds": dict(self.seconds),
+            "calls": dict(self.calls),
+            "sweeps": self.sweeps,
+            "find_agent_location_calls": self.find_agent_location_calls,
+            "q_peak_bytes": self.q_peak_bytes if self.trace_memory else None,
+        }
+
+    def __str__(self):
+        total = sum(self.seconds.values()) or 1.0
+        lines = [f"turns = {self.turns}, sweeps = {self.sweeps}, find_agent_location calls = {self.find_agent_location_calls}"]
+        for phase in PHASES:
+            lines.append(f"{phase}: {self.seconds[phase]:.4f} s ({self.seconds[phase] / total:.1%}), calls = {self.calls[phase]}")
+        if self.trace_memory:
+            lines.append(f"Q table peak memory: {self.q_peak_bytes / 2**20:.2f} MiB")
+        return "\n".join(lines)
@@ -0,0 +1,49 @@
+import numpy as np
+
+# Seeded random streams for the games. A game is seeded from one value (an
+# int, a SeedSequence such as a child of an experiment's, or a Generator)
+# and hands independent child generators to its map and its agents, so no
+# global random state is involved and a replay from the same seed is
+# bit-identical.
+
+
+def child_generators(seed, count):
+    # count independent Generators derived from seed (see np.random.default_rng
+    # for what seed may be; an existing Generator is spawned from).
+    return np.random.default_rng(seed).spawn(count)
+
+
+class UniformStream:
+    # Uniform [0, 1) draws handed out one at a time from blocks drawn with a
+    # single vectorized call. Which value each draw gets only depends on the
+    # generator and the number of draws before it.
+    __slots__ = ("rng", "block_size", "block", "index")
+
+    def __init__(self, rng, block_size=1024):
+        self.rng = rng
+        self.block_size = block_size
+        self.block = []
+        self.index = 0
+
+    def uniform(self):
+        if self.index == len(self.block):
+            self.block = self.rng.random(self.block_size).tolist()
+            self.index = 0
+        value = self.block[self.index]
+        self.index += 1
+        return value
+
+    def state(self):
+        # JSON serializable position of the stream: the generator state and
+        # the draws left in the current block.
+        return {"generator": self.rng.bit_generator.state, "block": self.block[self.index:]}
+
+    def restore(self, state):
+        # Continues exactly where the stream that gave state() was.
+        self.rng.bit_generator.state = state["generator"]
+        self.block = list(state["block"])
+        self.index = 0
+
+    def integers(self, high):
+        # Uniform integer in 0 .. high - 1.
+        return int(self.uniform() * high)
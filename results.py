@@ -0,0 +1,100 @@
+import glob
+import json
+import os
+
+import numpy as np
+
+# Streamed results of long experiment runs. Rows are buffered in a
+# structured array and written chunk_size at a time as numbered .npy shards
+# (results-00000.npy, ...), so a run never holds more than one chunk and a
+# crash loses at most the rows since the last shard. checkpoint() flushes and
+# then records, in checkpoint.json, how many shards and rows are complete
+# together with whatever state the run needs to carry on (game index, score,
+# RNG state, ...). resume() reads it back and drops shards written after it,
+# so the rows on disk always match the state that is resumed from.
+#
+# Shards and the checkpoint are written under a temporary name and renamed,
+# so a crash never leaves a truncated file behind.
+CHECKPOINT = "checkpoint.json"
+
+
+class ResultStream:
+    def __init__(self, directory, dtype, chunk_size=256):
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        os.makedirs(directory, exist_ok=True)
+        self.buffer = np.empty(chunk_size, dtype=self.dtype)
+        self.buffered = 0
+        self.shards = 0
+        self.rows = 0
+
+    def _shard_path(self, index):
+        return os.path.join(self.directory, f"results-{index:05d}.npy")
+
+    def append(self, row):
+        self.buffer[self.buffered] = row
+        self.buffered += 1
+        if self.buffered == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffered == 0:
+            return
+        path = self._shard_path(self.shards)
+        with open(path + ".partial", "wb") as f:
+            np.save(f, self.buffer[:self.buffered])
+        os.replace(path + ".partial", path)
+        self.shards += 1
+        self.rows += self.buffered
+        self.buffered = 0
+
+    def checkpoint(self, state):
+        # state must be JSON serializable; it is handed back by resume().
+        self.flush()
+        path = os.path.join(self.directory, CHECKPOINT)
+        with open(path + ".partial", "w") as f:
+            json.dump({"shards": self.shards, "rows": self.rows, "state": state}, f)
+        os.replace(path + ".partial", path)
+
+    def resume(self):
+        # The state of the last checkpoint, or None (and no rows) when there
+        # is none. Rows appended after it are discarded.
+        self.buffered = 0
+        path = os.path.join(self.directory, CHECKPOINT)
+        checkpoint = {"shards": 0, "rows": 0, "state": None}
+        if os.path.exists(path):
+            with open(path) as f:
+                checkpoint = json.load(f)
+        self.shards, self.rows = checkpoint["shards"], checkpoint["rows"]
+        for shard in glob.glob(os.path.join(self.directory, "results-*.npy")):
+            if int(os.path.basename(shard)[8:-4]) >= self.shards:
+                os.remove(shard)
+        return checkpoint["state"]
+
+    def clear(self):
+        # Forget every shard and the checkpoint: a fresh run in directory.
+        for path in glob.glob(os.path.join(self.directory, "results-*.npy")) + [os.path.join(self.directory, CHECKPOINT)]:
+            if os.path.exists(path):
+                os.remove(path)
+        self.buffered = self.shards = self.rows = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        # Rows buffered when an exception escapes are kept as well; only a
+        # checkpoint decides what a resume starts from.
+        self.close()
+        return False
+
+
+def load_results(directory):
+    # Every row written to directory, in order, as one structured array.
+    shards = sorted(glob.glob(os.path.join(directory, "results-*.npy")))
+    if not shards:
+        return None
+    return np.concatenate([np.load(shard) for shard in shards])
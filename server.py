@@ -0,0 +1,422 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from cache import table_key
+from events import NullSink
+from moves import ACTIONS, action_index
+from randomness import child_generators
+from tagmdp_2 import Game, GameMap
+
+# Many tagmdp_2 games hosted by one asyncio server, driven over a local TCP
+# socket with line-delimited JSON.
+#
+#   python server.py serve --port 8765
+#   python server.py load-test --port 8765 --clients 50
+#
+# Every request is one JSON object per line with an "op" and an optional "id"
+# that is echoed back; every reply is one line {"id", "ok", ...} or
+# {"id", "ok": false, "error"}. Ops:
+#   new    {max_turns, iterations, height, width, wall_prob, seed, sweep_mode,
+#           tolerance, connected, human: "R"/"T"/null} -> {session, state}
+#   state  {session, map: bool}                       -> {state}
+#   step   {session}    plays the next computer turn  -> {state}
+#   move   {session, action: "up"/.../null}  plays the human's turn -> {state}
+#   run    {session}    plays computer turns until the game ends or it is
+#                       the human's turn              -> {state}
+#   watch  {session}    pushes {"event": "turn"/"result", ...} lines for
+#                       every later turn of the session to this connection
+#   close  {session}
+# Map generation and the Bellman solve of a turn run in a process pool; the
+# event loop only picks the action and moves the agent, so one large map or
+# solve never holds up the other sessions. Maps are at most max_map_size
+# cells along each side, games at most max_iterations sweeps per turn and
+# max_turns turns long (serve --max-map-size, --max-iterations, --max-turns).
+# A watcher that does not read its events is dropped once more than
+# WATCH_BUFFER bytes are queued for it.
+DEFAULT_CONFIG = {
+    "max_turns": 75,
+    "iterations": 10,
+    "height": 11,
+    "width": 11,
+    "wall_prob": 0.2,
+    "seed": None,
+    "sweep_mode": "inplace",
+    "tolerance": None,
+    "connected": False,
+    "human": None,
+}
+
+MAX_MAP_SIZE = 1000
+MAX_ITERATIONS = 1000
+MAX_TURNS = 10000
+WATCH_BUFFER = 2**20
+
+# Per worker process: the last few maps solved on, so the distance field of
+# a session's map is built once per worker instead of once per turn.
+_worker_maps = OrderedDict()
+WORKER_MAPS = 16
+
+
+def build_map(height, width, wall_prob, seed, connected):
+    # The walls and agents of the map a Game seeded with seed would draw,
+    # built in a worker.
+    map_rng, _ = child_generators(seed, 2)
+    game_map = GameMap(height, width, wall_prob, map_rng, connected)
+    return game_map.walls, game_map.agents
+
+
+def solve_q(walls, agents, name, q_sa, iterations, sweep_mode, tolerance):
+    # Runs agent name's q_value_update in a worker and returns the updated
+    # table and its SweepReport.
+    key = table_key(walls)
+    game_map = _worker_maps.get(key)
+    if game_map is None:
+        game_map = GameMap.from_walls(walls, agents)
+        _worker_maps[key] = game_map
+        if len(_worker_maps) > WORKER_MAPS:
+            _worker_maps.popitem(last=False)
+    else:
+        _worker_maps.move_to_end(key)
+        game_map.agents = dict(agents)
+    game = Game(1, iterations, None, None, None, sweep_mode=sweep_mode, tolerance=tolerance, game_map=game_map)
+    agent = game.runner if name == "R" else game.tagger
+    agent.q_sa = q_sa
+    report = agent.q_value_update(iterations, tolerance=tolerance)
+    return agent.q_sa, report
+
+
+class WatchSink(NullSink):
+    # Forwards a session's turns and result to the connections watching it.
+    def __init__(self, session):
+        self.session = session
+        self.pending = None
+
+    def action(self, agent, kind, move, turn, q=None):
+        self.pending = (agent, kind, move)
+
+    def turn(self, turn, positions, render):
+        agent, kind, move = self.pending or (None, None, None)
+        self.session.broadcast({
+            "event": "turn", "session": self.session.id, "turn": turn,
+            "agent": agent, "kind": kind, "move": move,
+            "agents": {name: list(position) for name, position in positions.items()},
+        })
+        self.pending = None
+
+    def result(self, winner, turns):
+        self.session.broadcast({"event": "result", "session": self.session.id, "winner": winner, "turns": turns})
+
+
+class Session:
+    def __init__(self, session_id, config, game_map):
+        self.id = session_id
+        self.config = config
+        self.human = config["human"]
+        self.watchers = set()
+        self.lock = asyncio.Lock()
+        self.winner = None
+        self.game = Game(
+            config["max_turns"], config["iterations"], config["height"], config["width"], config["wall_prob"],
+            sweep_mode=config["sweep_mode"], tolerance=config["tolerance"], rng=config["seed"],
+            sink=WatchSink(self), game_map=game_map,
+        )
+
+    def broadcast(self, message):
+        line = (json.dumps(message) + "\n").encode()
+        for writer in list(self.watchers):
+            if writer.is_closing() or writer.transport.get_write_buffer_size() > WATCH_BUFFER:
+                self.watchers.discard(writer)
+            else:
+                writer.write(line)
+
+    def check_over(self):
+        # Same order as Game.run: a tag ends the game, then max_turns.
+        game = self.game
+        if self.winner is None and (game.terminal() or game.turn_counter >= game.max_turns):
+            self.winner = 1 if game.turn_counter >= game.max_turns else -1
+            game.sink.result(self.winner, game.turn_counter)
+        return self.winner is not None
+
+    def state(self, with_map=False):
+        game = self.game
+        state = {
+            "session": self.id,
+            "turn": game.turn_counter,
+            "to_move": game.to_move().name,
+            "agents": {name: list(position) for name, position in game.game_map.agents.items()},
+            "done": self.winner is not None,
+            "winner": self.winner,
+        }
+        if game.sweep_report is not None:
+            state["sweeps"] = game.sweep_report.sweeps
+        if with_map:
+            state["map"] = ["".join(row) for row in game.game_map.render()]
+        return state
+
+
+class GameServer:
+    def __init__(self, workers=None, max_sessions=10000, max_map_size=MAX_MAP_SIZE, max_iterations=MAX_ITERATIONS, max_turns=MAX_TURNS):
+        self.pool = ProcessPoolExecutor(workers or os.cpu_count() or 1)
+        self.sessions = {}
+        self.max_sessions = max_sessions
+        self.max_map_size = max_map_size
+        self.max_iterations = max_iterations
+        self.max_turns = max_turns
+        self.ids = itertools.count(1)
+        self.ops = {
+            "new": self.op_new, "state": self.op_state, "step": self.op_step, "move": self.op_move,
+            "run": self.op_run, "watch": self.op_watch, "close": self.op_close,
+        }
+
+    async def handle(self, reader, writer):
+        pending = set()
+        try:
+            while line := await reader.readline():
+                # Requests are served concurrently, so a slow solve in one
+                # session does not hold up this connection's other sessions.
+                task = asyncio.create_task(self.respond(line, writer))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            await asyncio.gather(*pending)
+        except ConnectionError:
+            pass
+        finally:
+            for session in self.sessions.values():
+                session.watchers.discard(writer)
+            writer.close()
+
+    async def respond(self, line, writer):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            op = self.ops.get(request.get("op"))
+            if op is None:
+                raise ValueError(f"Unknown op {request.get('op')!r}, expected one of {sorted(self.ops)}")
+            reply = await op(request, writer)
+            reply = {"id": request_id, "ok": True, **reply}
+        except Exception as error:
+            # Any failure is reported to the client instead of dropping the
+            # request.
+            reply = {"id": request_id, "ok": False, "error": str(error)}
+        writer.write((json.dumps(reply) + "\n").encode())
+        await writer.drain()
+
+    def session(self, request):
+        session = self.sessions.get(request.get("session"))
+        if session is None:
+            raise KeyError(f"No session {request.get('session')!r}")
+        return session
+
+    async def op_new(self, request, writer):
+        if len(self.sessions) >= self.max_sessions:
+            raise ValueError("Too many open sessions")
+        unknown = set(request) - set(DEFAULT_CONFIG) - {"op", "id"}
+        if unknown:
+            raise ValueError(f"Unknown settings {sorted(unknown)}")
+        config = {**DEFAULT_CONFIG, **{key: request[key] for key in DEFAULT_CONFIG if key in request}}
+        if config["human"] not in (None, "R", "T"):
+            raise ValueError("human must be 'R', 'T' or null")
+        limits = {"height": self.max_map_size, "width": self.max_map_size, "iterations": self.max_iterations, "max_turns": self.max_turns}
+        for key, limit in limits.items():
+            value = config[key]
+            if type(value) is not int or not 1 <= value <= limit:
+                raise ValueError(f"{key} must be an integer from 1 to {limit}, got {value!r}")
+        # The map is drawn in the pool and the session's Game replays the
+        # same seed, so a seedless session gets its seed here.
+        if config["seed"] is None:
+            config["seed"] = np.random.SeedSequence().entropy
+        walls, agents = await asyncio.get_running_loop().run_in_executor(
+            self.pool, build_map, config["height"], config["width"], config["wall_prob"], config["seed"], config["connected"],
+        )
+        if len(self.sessions) >= self.max_sessions:
+            raise ValueError("Too many open sessions")
+        session = Session(next(self.ids), config, GameMap.from_walls(walls, agents))
+        self.sessions[session.id] = session
+        return {"session": session.id, "state": session.state(with_map=True)}
+
+    async def op_state(self, request, writer):
+        return {"state": self.session(request).state(with_map=request.get("map", False))}
+
+    async def computer_turn(self, session):
+        game = session.game
+        agent = game.to_move()
+        q_sa, game.sweep_report = await asyncio.get_running_loop().run_in_executor(
+            self.pool, solve_q, game.game_map.walls, game.game_map.agents, agent.name, agent.q_sa,
+            game.iterations, game.sweep_mode, game.tolerance,
+        )
+        agent.q_sa = q_sa
+        game.finish_turn(agent, agent.best_action())
+
+    async def op_step(self, request, writer):
+        session = self.session(request)
+        async with session.lock:
+            if not session.check_over():
+                if session.game.to_move().name == session.human:
+                    raise ValueError(f"It is the human {session.human}'s turn; send a move")
+                await self.computer_turn(session)
+                session.check_over()
+        return {"state": session.state()}
+
+    async def op_move(self, request, writer):
+        session = self.session(request)
+        async with session.lock:
+            game = session.game
+            agent = game.to_move()
+            if session.check_over():
+                raise ValueError("The game is over")
+            if agent.name != session.human:
+                raise ValueError(f"It is the computer's turn ({agent.name}); send a step")
+            name = request.get("action")
+            if name is not None and name not in ACTIONS:
+                raise ValueError(f"Unknown action {name!r}, expected one of {list(ACTIONS)} or null")
+            action = action_index(name)
+            if name is not None and action not in agent.move_options()[1]:
+                raise ValueError(f"{name} is blocked")
+            game.sink.action(agent.name, "human", name, game.turn_counter)
+            game.finish_turn(agent, action)
+            session.check_over()
+        return {"state": session.state()}
+
+    async def op_run(self, request, writer):
+        session = self.session(request)
+        async with session.lock:
+            while not session.check_over() and session.game.to_move().name != session.human:
+                await self.computer_turn(session)
+        return {"state": session.state()}
+
+    async def op_watch(self, request, writer):
+        session = self.session(request)
+        session.watchers.add(writer)
+        return {"state": session.state(with_map=True)}
+
+    async def op_close(self, request, writer):
+        session = self.session(request)
+        del self.sessions[session.id]
+        return {"session": session.id}
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+async def serve(host, port, workers=None, ready=None, max_map_size=MAX_MAP_SIZE, max_iterations=MAX_ITERATIONS, max_turns=MAX_TURNS):
+    game_server = GameServer(workers, max_map_size=max_map_size, max_iterations=max_iterations, max_turns=max_turns)
+    server = await asyncio.start_server(game_server.handle, host, port, limit=2**20)
+    if ready is not None:
+        ready(server)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        game_server.close()
+
+
+class Client:
+    # Minimal client for the protocol: one request at a time per client.
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count(1)
+
+    @classmethod
+    async def connect(cls, host, port):
+        return cls(*await asyncio.open_connection(host, port, limit=2**20))
+
+    async def request(self, op, **fields):
+        request_id = next(self.ids)
+        self.writer.write((json.dumps({"op": op, "id": request_id, **fields}) + "\n").encode())
+        await self.writer.drain()
+        while True:
+            reply = json.loads(await self.reader.readline())
+            if reply.get("id") == request_id:
+                break
+        if not reply["ok"]:
+            raise RuntimeError(reply["error"])
+        return reply
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def load_test(host, port, clients, games, **config):
+    # clients concurrent connections, each playing games games turn by turn;
+    # returns the seconds every step request took and the total wall time.
+    latencies = []
+    winners = []
+
+    async def play(client_index):
+        client = await Client.connect(host, port)
+        try:
+            for game_index in range(games):
+                seed = client_index * games + game_index
+                session = (await client.request("new", seed=seed, **config))["session"]
+                while True:
+                    start_time = time.perf_counter()
+                    state = (await client.request("step", session=session))["state"]
+                    latencies.append(time.perf_counter() - start_time)
+                    if state["done"]:
+                        winners.append(state["winner"])
+                        break
+                await client.request("close", session=session)
+        finally:
+            await client.close()
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(play(index) for index in range(clients)))
+    return np.array(latencies), winners, time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host tag games over a local socket, or load-test such a server.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--workers", type=int, default=None, help="solver processes")
+    serve_parser.add_argument("--max-map-size", type=int, default=MAX_MAP_SIZE, help="largest map height and width a client may ask for")
+    serve_parser.add_argument("--max-iterations", type=int, default=MAX_ITERATIONS, help="most sweeps per turn a client may ask for")
+    serve_parser.add_argument("--max-turns", type=int, default=MAX_TURNS, help="longest game a client may ask for")
+    test = commands.add_parser("load-test")
+    test.add_argument("--host", default="127.0.0.1")
+    test.add_argument("--port", type=int, default=8765)
+    test.add_argument("--clients", type=int, default=20)
+    test.add_argument("--games", type=int, default=1, help="games per client")
+    test.add_argument("--size", type=int, default=21)
+    test.add_argument("--wall-prob", type=float, default=0.2)
+    test.add_argument("--iterations", type=int, default=10)
+    test.add_argument("--max-turns", type=int, default=75)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        def ready(server):
+            print(f"Serving on {', '.join(str(socket.getsockname()) for socket in server.sockets)}", flush=True)
+
+        try:
+            asyncio.run(serve(args.host, args.port, args.workers, ready, args.max_map_size, args.max_iterations, args.max_turns))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    latencies, winners, elapsed_time = asyncio.run(load_test(
+        args.host, args.port, args.clients, args.games, height=args.size, width=args.size,
+        wall_prob=args.wall_prob, iterations=args.iterations, max_turns=args.max_turns,
+    ))
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1e3
+    print(f'games = {len(winners)}, runner win rate = {np.mean(np.array(winners) == 1):.3f}, steps = {len(latencies)}')
+    print(f'step latency: p50 = {p50:.2f} ms, p90 = {p90:.2f} ms, p99 = {p99:.2f} ms')
+    print(f'Elapsed time: {elapsed_time:.3f} seconds, steps per second = {len(latencies) / elapsed_time:.1f}')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+import os
+
+import numpy as np
+
+# On-disk maps and Q tables for grids too large to keep as Python lists or
+# dense in-RAM arrays.
+#
+# A map file is a fixed 32 byte header (HEADER_DTYPE) followed by the wall
+# grid as a bitmap: one bit per cell, every row packed into whole bytes with
+# np.packbits. open_map memory-maps the bitmap, so opening a 10k x 10k map
+# reads nothing but the header and rows are unpacked as they are used.
+# Agent positions are stored in the header, (-1, -1) when there is none.
+#
+# Q tables are plain .npy files of float32 opened with np.memmap (through
+# np.lib.format.open_memmap), so they can be read and swept in place.
+MAGIC = b"TAGMAP01"
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("rows", "<u4"),
+    ("columns", "<u4"),
+    ("runner", "<i4", 2),
+    ("tagger", "<i4", 2),
+])
+AGENT_FIELDS = {"R": "runner", "T": "tagger"}
+
+
+def row_bytes(num_columns):
+    return (num_columns + 7) // 8
+
+
+class PackedWalls:
+    # Read-only bool grid over a bit-packed (rows, row_bytes) array such as
+    # the memory-mapped bitmap of a map file. walls[y, x], walls[y] and row
+    # slices only unpack the rows they touch; np.asarray(walls) unpacks the
+    # whole grid.
+    def __init__(self, bits, num_columns):
+        self.bits = bits
+        self.shape = (bits.shape[0], num_columns)
+        self.ndim = 2
+        self.dtype = np.dtype(bool)
+
+    def rows(self, start, stop):
+        return np.unpackbits(self.bits[start:stop], axis=1, count=self.shape[1]).view(bool)
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        row, rest = index[0], index[1:]
+        if isinstance(row, (int, np.integer)):
+            row = range(self.shape[0])[row]
+            if len(rest) == 1 and isinstance(rest[0], (int, np.integer)):
+                x = range(self.shape[1])[rest[0]]
+                return bool(self.bits[row, x >> 3] & (0x80 >> (x & 7)))
+            return self.rows(row, row + 1)[0][rest]
+        if isinstance(row, slice) and row.step in (None, 1):
+            start, stop, _ = row.indices(self.shape[0])
+            return self.rows(start, stop)[(slice(None),) + rest]
+        return np.asarray(self)[index]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        walls = self.rows(0, self.shape[0])
+        return walls if dtype is None else walls.astype(dtype)
+
+
+def save_map(path, walls, agents=None, tile_rows=4096):
+    # walls may be any (rows, columns) bool grid, including a memmap or a
+    # PackedWalls; it is packed and written tile_rows rows at a time.
+    agents = {} if agents is None else agents
+    num_rows, num_columns = walls.shape
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header["magic"] = MAGIC
+    header["rows"] = num_rows
+    header["columns"] = num_columns
+    for agent, field in AGENT_FIELDS.items():
+        header[field] = agents.get(agent, (-1, -1))
+    with open(path, "wb") as f:
+        f.write(header.tobytes())
+        for start in range(0, num_rows, tile_rows):
+            tile = np.asarray(walls[start:start + tile_rows], dtype=bool)
+            f.write(np.packbits(tile, axis=1).tobytes())
+
+
+def is_map_file(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def open_map(path, mode="r"):
+    # Returns the walls as a PackedWalls over a memory-mapped bitmap and the
+    # agent positions as a {"R": (y, x), "T": (y, x)} dict.
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    if header.size == 0 or header["magic"][0] != MAGIC:
+        raise ValueError(f"{path} is not a tag map file")
+    header = header[0]
+    num_rows, num_columns = int(header["rows"]), int(header["columns"])
+    bits = np.memmap(path, dtype=np.uint8, mode=mode, offset=HEADER_DTYPE.itemsize, shape=(num_rows, row_bytes(num_columns)))
+    agents = {}
+    for agent, field in AGENT_FIELDS.items():
+        y, x = (int(v) for v in header[field])
+        if y >= 0:
+            agents[agent] = (y, x)
+    return PackedWalls(bits, num_columns), agents
+
+
+def convert_text_map(text_path, path):
+    # Converts a text map ('#' walls, 'R' and 'T' agents) line by line, so
+    # the text never has to fit in memory. Short lines are padded with free
+    # cells.
+    num_rows = num_columns = 0
+    with open(text_path, "r") as f:
+        for line in f:
+            num_rows += 1
+            num_columns = max(num_columns, len(line.rstrip("\r\n")))
+    agents = {}
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header["magic"] = MAGIC
+    header["rows"] = num_rows
+    header["columns"] = num_columns
+    with open(text_path, "r") as text, open(path, "wb") as f:
+        f.write(header.tobytes())
+        for y, line in enumerate(text):
+            row = np.frombuffer(line.rstrip("\r\n").ljust(num_columns).encode("latin-1"), dtype=np.uint8)
+            f.write(np.packbits(row == ord("#")).tobytes())
+            for agent in AGENT_FIELDS:
+                x = line.find(agent)
+                if x >= 0:
+                    agents[agent] = (y, x)
+        for agent, field in AGENT_FIELDS.items():
+            header[field] = agents.get(agent, (-1, -1))
+        f.seek(0)
+        f.write(header.tobytes())
+    return agents
+
+
+def open_q_table(path, shape=None):
+    # With a shape, creates a fresh zero-filled float32 table at path;
+    # without one, opens the existing table for reading and writing.
+    if shape is None:
+        return np.load(path, mmap_mode="r+")
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=tuple(shape))
@@ -1,205 +1,279 @@
-import numpy as np
-import random
+import os
 import time
+import numpy as np
+from bellman import BellmanSweeper, TiledSweeper, border_masks, terminal_masks
+from cache import QTableCache, table_key
+from distances import DistanceField
+from events import ConsoleSink, NullSink
+from moves import WAIT, MoveTable, action_name
+from placement import fill_pockets, place_agents
+from profiling import NO_PHASE
+from randomness import UniformStream, child_generators
+from results import ResultStream
+from storage import is_map_file, open_map, open_q_table
+
+# The legacy tag engine. Importing it has no side effects: everything a game
+# touches lives in a GameState that is passed to every function, so worker
+# processes can import it and play many independent games side by side.
+#
+#   python tagMDP.py --max-turns 20 --z 20 --height 15 --width 15 --wall-prob 0.3
+#   python tagMDP.py --experiment --directory results
+
+list_of_actions = ["up","down","left","right"]  # action i is list_of_actions[i], WAIT is -1
+
+class GameState:
+    # One game's map and agent positions, the distance field and move table
+    # of that map, the random streams and the solver settings.
+    #   seed            - maps are drawn from mapRng and the epsilon/alpha
+    #                     draws of bestAction from randomStream, both children
+    #                     of seed
+    #   sink            - receives the action, turn and result events (see
+    #                     events.py); None is a NullSink
+    #   sweepMode       - the bellman sweep mode
+    #   wavefrontSolve  - solve the Tagger's Q table exactly with one BFS
+    #                     wavefront, the cells at and next to the Runner being
+    #                     terminal (the Runner's rewards are not a uniform step
+    #                     cost, so its table is still swept)
+    #   tolerance       - stop the Bellman sweeps early once no cell moves by
+    #                     more than this (None always runs all z sweeps)
+    #   warmStart       - seed the Runner's Q table from its previous one and
+    #                     only re-relax the cells the last move disturbed (the
+    #                     Tagger's table never settles, so it is always solved
+    #                     from scratch)
+    #   qDirectory      - keep the Q tables in this directory as float32
+    #                     memmaps swept by bellman.TiledSweeper ("jacobi"
+    #                     order; sweepMode and wavefrontSolve are not used,
+    #                     and a warm start only seeds the sweeps)
+    #   qCache          - a cache.QTableCache of solved Q tables keyed by map,
+    #                     positions and solver settings; None disables it
+    #   gameStats       - a profiling.GameStats to time the phases of every
+    #                     turn and keep a per-turn trace
+    def __init__(self, seed=None, sink=None, sweepMode="inplace", wavefrontSolve=False, tolerance=None, warmStart=False, qDirectory=None, qCache=None, gameStats=None):
+        self.mapRng, playRng = child_generators(seed, 2)
+        self.randomStream = UniformStream(playRng)
+        self.sink = NullSink() if sink is None else sink
+        self.sweepMode = sweepMode
+        self.wavefrontSolve = wavefrontSolve
+        self.tolerance = tolerance
+        self.warmStart = warmStart
+        self.qDirectory = qDirectory
+        self.qTables = {}
+        self.qCache = qCache
+        self.gameStats = gameStats
+        self.game_map = None
+        self.num_rows = self.num_columns = 0
+        self.agentLocations = {}
+        self.distanceField = None
+        self.distanceFieldMap = None
+        self.moveTable = None
+        self.moveTableField = None
+        self.sweepReport = None
+        self.TurnCounter = 0
+
+def setMap(state, game_map):
+    # Plays the next game on game_map (a list of rows of characters).
+    state.game_map = game_map
+    state.num_rows = len(game_map)
+    state.num_columns = len(game_map[0])
+    state.agentLocations = {}
+
+def phase(state, name):
+    return NO_PHASE if state.gameStats is None else state.gameStats.phase(name)
 
 def load_game_map(filename):
+    # Binary maps (storage.save_map) are unpacked from their bitmap; text
+    # maps are read a line at a time.
+    if is_map_file(filename):
+        walls, agents = open_map(filename)
+        game_map = np.where(np.asarray(walls), "#", " ").tolist()
+        for agent, (y, x) in agents.items():
+            game_map[y][x] = agent
+        return game_map
     with open(filename, 'r') as f:
-        lines = f.readlines()
-    return [[c for c in line.strip()] for line in lines]
+        return [[c for c in line.strip()] for line in f]
 
-def generate_random_map(num_rows, num_columns, wall_probability):
-    game_map = []
-    for i in range(num_rows):
-        row = []
-        for j in range(num_columns):
-            if i == 0 or i == num_rows - 1 or j == 0 or j == num_columns - 1:
-                # Place a wall on the edges of the map
-                row.append("#")
-            elif random.random() < wall_probability:
-                # Place a wall with probability wall_probability
-                row.append("#")
-            else:
-                row.append(" ")
-        game_map.append(row)
-    # Place agent R at a random location
-    r_row = random.randint(1, num_rows - 2)
-    r_column = random.randint(1, num_columns - 2)
+def generate_random_map(num_rows, num_columns, wall_probability, rng=None, connected=False):
+    if rng is None:
+        rng = np.random.default_rng()
+    # Place a wall with probability wall_probability, and on the edges of the map
+    walls = rng.random((num_rows, num_columns), dtype=np.float32) < wall_probability
+    walls[[0, -1], :] = True
+    walls[:, [0, -1]] = True
+    # Optionally wall off the pockets that cannot reach the largest open area
+    components = fill_pockets(walls) if connected else None
+    # Place agents R and T on free cells they can walk between, with T more
+    # than 2 rows and 2 columns away from R
+    (r_row, r_column), (t_row, t_column) = place_agents(walls, rng, components)
+    game_map = np.where(walls, "#", " ").tolist()
     game_map[r_row][r_column] = "R"
-    # Place agent T at a random location, avoiding the location of agent R
-    # and locations that are next to agent R
-    t_row = random.randint(1, num_rows - 2)
-    t_column = random.randint(1, num_columns - 2)
-    while (t_row, t_column) == (r_row, r_column) or abs(t_row - r_row) <= 2 or abs(t_column - r_column) <= 2:
-        t_row = random.randint(1, num_rows - 2)
-        t_column = random.randint(1, num_columns - 2)
     game_map[t_row][t_column] = "T"
     return game_map
 
-# game_map = load_game_map('map.txt')
-taggerLocation = (0,0)
-list_of_actions = ["up","down","left","right"]
-TurnCounter = 0
-
-def find_agent_location(agent):
-    for i in range(num_rows):
-        for j in range(num_columns):
+def find_agent_location(state, agent):
+    # Act keeps agentLocations up to date, so the map is only scanned when
+    # an agent has not been seen on this map yet (e.g. a freshly generated one).
+    if state.gameStats is not None:
+        state.gameStats.find_agent_location_calls += 1
+    game_map = state.game_map
+    location = state.agentLocations.get(agent)
+    if location is not None and location[0] < state.num_rows and location[1] < state.num_columns and game_map[location[0]][location[1]] == agent:
+        return location
+    for i in range(state.num_rows):
+        for j in range(state.num_columns):
             if game_map[i][j] == agent:
+                state.agentLocations[agent] = (i, j)
                 return (i, j)
     return None
 
-def isWall(currentY, currentX):
+def moveAgent(state, agent, locationy, locationx, newy, newx):
+    state.game_map[locationy][locationx] = " "
+    state.game_map[newy][newx] = agent
+    state.agentLocations[agent] = (newy, newx)
+
+def isWall(game_map, currentY, currentX):
     if game_map[currentY][currentX] == '#':
         return True
     else:
         return False
 
-def Act(action,agent,previous):
-    locationy,locationx = find_agent_location(agent)
-    if action == "up" and previous != "down":
-        if locationy < len(game_map) and not isWall(locationy-1,locationx):
-            game_map[locationy][locationx] = " "
-            game_map[locationy-1][locationx] = agent
-            return True
-    if action == "down" and previous != "up":
-        if locationy > 0 and not isWall(locationy+1,locationx):
-            game_map[locationy][locationx] = " "
-            game_map[locationy+1][locationx] = agent
-            return True
-    if action == "right" and previous != "left":
-        if locationx < len(game_map[0]) and not isWall(locationy,locationx+1):
-            game_map[locationy][locationx] = " "
-            game_map[locationy][locationx+1] = agent
-            return True
-    if action == "left" and previous != "right":
-        if locationx > 0 and not isWall(locationy,locationx-1):
-            game_map[locationy][locationx] = " "
-            game_map[locationy][locationx-1] = agent
-            return True
+def Act(state,action,agent,previous):
+    # action is an index into list_of_actions, or WAIT
+    table = getMoveTable(state)
+    locationy,locationx = find_agent_location(state,agent)
+    cell = table.cell(locationy,locationx)
+    if action in table.options(cell,previous):
+        newy,newx = table.position(cell,action)
+        moveAgent(state,agent,locationy,locationx,newy,newx)
+        return True
     return False
 
-def ActCords(action,agent,previous):
-    locationy,locationx = find_agent_location(agent)
-    if action == "up" and previous != "down":
-        if locationy < len(game_map) and not isWall(locationy-1,locationx):
-            return (locationy-1,locationx)
-    if action == "down" and previous != "up":
-        if locationy > 0 and not isWall(locationy+1,locationx):
-            return (locationy+1,locationx)
-    if action == "right" and previous != "left":
-        if locationx < len(game_map[0]) and not isWall(locationy,locationx+1):
-            return (locationy,locationx+1)
-    if action == "left" and previous != "right":
-        if locationx > 0 and not isWall(locationy,locationx-1):
-            return (locationy,locationx-1)
-    return False
+def getDistanceField(state):
+    # BFS distances are built once per map and reused every turn.
+    if state.distanceField is None or state.distanceFieldMap is not state.game_map:
+        state.distanceField = DistanceField(np.array(state.game_map) == '#')
+        state.distanceFieldMap = state.game_map
+    return state.distanceField
+
+def getMoveTable(state):
+    # Neighbour cells and legal moves of every free cell, built with the
+    # distance field of the same map.
+    field = getDistanceField(state)
+    if state.moveTable is None or state.moveTableField is not field:
+        state.moveTable = MoveTable(field.walls)
+        state.moveTableField = field
+    return state.moveTable
 
-def rewardFunctionTag():
-    global rewardListTagger
-    rewardListTagger = np.zeros((num_rows,num_columns))
-    locationy,locationx = find_agent_location("R")
+def rewardFunctionTag(state):
+    field = getDistanceField(state)
+    distance = field.grid(*find_agent_location(state,"R"))
     reward = 20
-    for i in range(num_rows):
-        for j in range(num_columns):
-            distance_from_runner = abs(i - locationy) + abs(j - locationx)
-            if distance_from_runner == 1:
-                rewardListTagger[i][j] = reward-10
-            elif distance_from_runner == 0:
-                rewardListTagger[i][j] = reward
-            else:
-                rewardListTagger[i][j] = -1
-                if isWall(i,j):
-                    rewardListTagger[i][j] = -3
+    rewardListTagger = np.full((state.num_rows,state.num_columns), -1.0)
+    rewardListTagger[field.walls] = -3
+    rewardListTagger[distance == 1] = reward-10
+    rewardListTagger[distance == 0] = reward
     return rewardListTagger
 
-def rewardFunctionRun():
-    global rewardListRun
-    rewardListRun = np.zeros((num_rows,num_columns))
-    locationy,locationx = find_agent_location("T")
+def rewardFunctionRun(state):
+    field = getDistanceField(state)
+    distance = field.grid(*find_agent_location(state,"T")).astype(np.int64)
     reward = -20
-    for i in range(num_rows):
-        for j in range(num_columns):
-            distance_from_tagger = abs(i - locationy) + abs(j - locationx)
-            if distance_from_tagger == 0:
-                rewardListRun[i][j] = 0
-            else:
-                if isWall(i,j):
-                    rewardListRun[i][j] = (reward // (distance_from_tagger)) - 8
-                else:
-                    rewardListRun[i][j] = reward // distance_from_tagger
+    # Walls and cells the tagger cannot reach count as UNREACHABLE steps away
+    rewardListRun = (reward // np.maximum(distance, 1)).astype(float)
+    rewardListRun[field.walls] -= 8
+    rewardListRun[distance == 0] = 0
     return rewardListRun
 
-def Terminal():
-    locationyR, locationxR = find_agent_location("R")
-    locationyT, locationxT = find_agent_location("T")
+def Terminal(state):
+    locationyR, locationxR = find_agent_location(state,"R")
+    locationyT, locationxT = find_agent_location(state,"T")
     if abs(locationyR - locationyT) + abs(locationxR - locationxT) == 1:
-        print("Player Tag has won the game!")
         return True
 
-def Q_value_Run(z,gamma=1):
-    Q_sa = np.zeros([num_rows, num_columns])
-    for i in range(z):
-        for i in range(num_rows):
-            for j in range(num_columns):
-                if j == 0 or j == num_columns-1:
-                    Q_sa[i][j] = -10
-                elif i == 0 or i == num_rows-1:
-                    Q_sa[i][j] = -10
-                elif game_map[i][j] == "R":
-                    Q_sa[i][j] = 0
-                else:
-                    Q_sa[i][j] = rewardListRun[i][j] + gamma * max(Q_sa[i-1][j], Q_sa[i+1][j], Q_sa[i][j-1], Q_sa[i][j+1])
-    return Q_sa
+def qCacheKey(state,agent,z,gamma,tolerance):
+    # Everything a cold solve depends on: the walls, whose table it is, both
+    # positions (the reward follows the opponent) and the solver settings.
+    return table_key(getDistanceField(state).walls, agent, find_agent_location(state,"R"), find_agent_location(state,"T"), z, gamma, tolerance, "tiled" if state.qDirectory is not None else state.sweepMode, state.wavefrontSolve)
+
+def newSweeper(state,masks,gamma):
+    return BellmanSweeper(*masks, gamma=gamma, mode=state.sweepMode)
+
+def getQTables(state,agent):
+    # agent's memory-mapped Q table in state.qDirectory and the scratch buffer
+    # its sweeps double-buffer through, opened once per map size; every solve
+    # overwrites the table returned by the last one.
+    shape = (state.num_rows, state.num_columns)
+    tables = state.qTables.get(agent)
+    if tables is None or tables[0].shape != shape:
+        tables = tuple(open_q_table(os.path.join(state.qDirectory, agent + suffix), shape) for suffix in (".npy", ".scratch.npy"))
+        state.qTables[agent] = tables
+    return tables
 
-def Q_value_Tag(z,gamma=1):
-    Q_sa = np.zeros([num_rows, num_columns])
-    for i in range(z):
-        for i in range(num_rows):
-            for j in range(num_columns):
-                if j == 0 or j == num_columns-1:
-                    Q_sa[i][j] = -10
-                elif i == 0 or i == num_rows-1:
-                    Q_sa[i][j] = -10
-                elif game_map[i][j] == "T":
-                    Q_sa[i][j] = 0
-                else:
-                    Q_sa[i][j] = rewardListTagger[i][j] + gamma * max(Q_sa[i-1][j], Q_sa[i+1][j], Q_sa[i][j-1], Q_sa[i][j+1])
+def Q_value(state,agent,rewardList,z,gamma=1,tolerance=None,previous=None):
+    # The Q table of agent for rewardList; the solve's SweepReport is left
+    # in state.sweepReport (None when it came from the cache).
+    key = None
+    if state.qCache is not None and previous is None:
+        key = qCacheKey(state,agent,z,gamma,tolerance)
+        cached = state.qCache.get(key)
+        if cached is not None:
+            state.sweepReport = None
+            return cached.astype(float)
+    shape = (state.num_rows, state.num_columns)
+    if state.qDirectory is not None:
+        Q_sa, scratch = getQTables(state,agent)
+        if previous is None:
+            Q_sa.fill(0)
+        elif previous is not Q_sa:
+            Q_sa[...] = previous
+        sweeper = TiledSweeper(shape, find_agent_location(state,agent), border_value=-10, gamma=gamma)
+        sweepReport = sweeper.solve(Q_sa, rewardList, z, tolerance, scratch=scratch)
+    else:
+        masks = border_masks(shape, find_agent_location(state,agent), border_value=-10)
+        sweeper = newSweeper(state, masks, gamma)
+        Q_sa = np.zeros(shape)
+        sweepReport = None
+        if state.wavefrontSolve:
+            # A tag ends the game: the Tagger's table is solved with the cells
+            # at and next to the Runner terminal and the walls pinned out.
+            if agent == "T":
+                wavefrontSweeper = BellmanSweeper(*terminal_masks(rewardList), gamma=gamma, walls=getDistanceField(state).walls)
+            else:
+                wavefrontSweeper = sweeper
+            sweepReport = wavefrontSweeper.wavefront(Q_sa, rewardList)
+    if sweepReport is not None:
+        pass
+    elif previous is not None:
+        Q_sa = previous.copy()
+        sweepReport = sweeper.relax(Q_sa, rewardList, z, tolerance)
+    else:
+        sweepReport = sweeper.solve(Q_sa, rewardList, z, tolerance)
+    state.sweepReport = sweepReport
+    if key is not None:
+        state.qCache.put(key, Q_sa)
     return Q_sa
 
-def bestAction(agent,Q_sa,previous, epsilon=0.05, alpha=0.95):
-    i,j = find_agent_location(agent)
-    Top = -999999
-    bestMove = None
-    highestDistance = 10000
-    lowestDistance = 10000
-    if np.random.uniform() > alpha:
-        bestMove = None
-        print(f'The agent {agent} has chosen an awaitening move: {bestMove}, Turn = {TurnCounter}')
-        return bestMove
-    if np.random.uniform() < epsilon:
-        i = np.random.randint(len(list_of_actions))
-        if ActCords(list_of_actions[i],agent,previous) != False:
-            bestMove = list_of_actions[i]
-            print(f'The agent {agent} has chosen a random exploration move: {bestMove}, Turn = {TurnCounter}')
-            return bestMove
-    for act in list_of_actions:
-        if ActCords(act,agent,previous) != False:
-            y,x = ActCords(act,agent,previous)
-            current = Q_sa[y][x]
-            if current >= Top:
-                Top = current
-                bestMove = act
-                if agent == "T":
-                    a,b = find_agent_location("R")
-                    if lowestDistance > abs(abs(i-y) - a) + abs(abs(j-x) - b):
-                        lowestDistance = abs(abs(i-y) - a) + abs(abs(j-x) - b)
-                        if current == Top:
-                            bestMove = act
-                else:
-                    a,b = find_agent_location("T")
-                    if highestDistance > abs(abs(i-y) - a) + abs(abs(j-x) - b):
-                        if current == Top:
-                            bestMove = act
-    print(f'The agent {agent} has chosen the best move: {bestMove}, Turn = {TurnCounter}, Q_sa = {Top:.3f}')
+def Q_value_Run(state,rewardListRun,z,gamma=1,tolerance=None,previous=None):
+    return Q_value(state,"R",rewardListRun,z,gamma,tolerance,previous)
+
+def Q_value_Tag(state,rewardListTagger,z,gamma=1,tolerance=None,previous=None):
+    return Q_value(state,"T",rewardListTagger,z,gamma,tolerance,previous)
+
+def bestAction(state,agent,Q_sa,previous, epsilon=0.05, alpha=0.95):
+    draws = state.randomStream
+    table = getMoveTable(state)
+    cell = table.cell(*find_agent_location(state,agent))
+    options = table.options(cell,previous)
+    if draws.uniform() > alpha:
+        state.sink.action(agent, "awaiting", None, state.TurnCounter)
+        return WAIT
+    if draws.uniform() < epsilon:
+        i = draws.integers(len(list_of_actions))
+        if i in options:
+            state.sink.action(agent, "exploration", list_of_actions[i], state.TurnCounter)
+            return i
+    # The last of the best allowed moves wins, counting up from -999999
+    bestMove, Top = table.greedy(Q_sa,cell,options,floor=-999999,last=True)
+    state.sink.action(agent, "best", action_name(bestMove), state.TurnCounter, Top)
     return bestMove
 
 def printMap(game,turnCounter=10):
@@ -207,96 +281,161 @@ def printMap(game,turnCounter=10):
         for row in game:
             print(' '.join(row))
 
-def Game(maxTurns,z,m,n):
-    global num_columns,num_rows,game_map,TurnCounter,previousActR,previousActT
-    previousActR = None
-    previousActT = None
-    bestAct = None
-    TurnCounter = 0
-    while not Terminal():
-        num_rows = len(game_map)
-        num_columns = len(game_map[0])
-        if TurnCounter % 2 == 0:
-            rewardFunctionRun()
-            Q_run = Q_value_Run(z)
+def Game(state,maxTurns,z):
+    # Plays one game on state's map; 1 if the Runner survived maxTurns turns,
+    # -1 if it was tagged.
+    previousActR = WAIT
+    previousActT = WAIT
+    bestAct = WAIT
+    Q_run = None
+    Q_tag = None
+    stats = state.gameStats
+    state.TurnCounter = 0
+    while not Terminal(state):
+        if stats is not None:
+            stats.begin_turn(state.TurnCounter + 1, "R" if state.TurnCounter % 2 == 0 else "T")
+        if state.TurnCounter % 2 == 0:
+            with phase(state, "reward"):
+                rewardListRun = rewardFunctionRun(state)
+            with phase(state, "sweeps"):
+                Q_run = Q_value_Run(state,rewardListRun,z,tolerance=state.tolerance,previous=Q_run if state.warmStart else None)
             agent = "R"
-            bestAct = bestAction(agent,Q_run,previousActR)
-            Act(bestAct,agent,previousActR)
+            with phase(state, "action"):
+                bestAct = bestAction(state,agent,Q_run,previousActR)
+            with phase(state, "move"):
+                Act(state,bestAct,agent,previousActR)
             previousActR = bestAct
-            bestAct = None
-        if TurnCounter % 2 == 1:
-            rewardFunctionTag()
-            Q_tag = Q_value_Tag(z)
+            bestAct = WAIT
+            Q_sa = Q_run
+        if state.TurnCounter % 2 == 1:
+            with phase(state, "reward"):
+                rewardListTagger = rewardFunctionTag(state)
+            with phase(state, "sweeps"):
+                Q_tag = Q_value_Tag(state,rewardListTagger,z,tolerance=state.tolerance)
             agent = "T"
-            bestAct = bestAction(agent,Q_tag,previousActT)
-            Act(bestAct,agent,previousActT)
+            with phase(state, "action"):
+                bestAct = bestAction(state,agent,Q_tag,previousActT)
+            with phase(state, "move"):
+                Act(state,bestAct,agent,previousActT)
             previousActT = bestAct
-            bestAct = None
-        TurnCounter += 1
-        print("-"*(n*2))
-        printMap(game_map,TurnCounter)
-        if TurnCounter == maxTurns:
-            print("Player Run has won the game!")
+            bestAct = WAIT
+            Q_sa = Q_tag
+        state.TurnCounter += 1
+        with phase(state, "render"):
+            state.sink.turn(state.TurnCounter, state.agentLocations, lambda: state.game_map)
+        if stats is not None:
+            stats.end_turn(state.sweepReport, Q_sa)
+        if state.TurnCounter == maxTurns:
+            state.sink.result(1, state.TurnCounter)
             return 1
+    state.sink.result(-1, state.TurnCounter)
     return -1
 
-def main():
-    global num_columns,num_rows,game_map,TurnCounter,previousActR,previousActT
-    TurnCounter = 0
-    print("Enter the number of maximum turns the Runner gets before winning the game")
-    maxTurns = input("maxTurns = ")
-    maxTurns = int(maxTurns)
-    print("Enter number of iterations the Bellman equation is allowed (1-100000)")
-    z = input("z = ")
-    z = int(z)
-    print("Please enter the dimensions of your map:")
-    m = input("Height = ")
-    m = int(m)
-    n = input("Width = ")
-    n = int(n)
-    az = input("Wall probability (0 to 1) = ")
-    wallprob = float(az)
-    game_map = generate_random_map(m,n,wallprob)
-    print("This will be your map for the game:")
-    print("-------------------------------------")
-    printMap(game_map,turnCounter=10)
-    print("-------------------------------------")
-    print("Do you wish to regenerate the map?")
-    regen = input("Y/N? ")
-    if regen == "Y":
-        game_map = generate_random_map(m,n,wallprob)
+# One row per Experiment game, streamed to results-*.npy shards (see results.py)
+experimentDtype = np.dtype([
+    ("game", np.int32),
+    ("score", np.int32),  # before the game
+    ("z", np.int32),
+    ("maxTurns", np.int32),
+    ("winner", np.int8),
+    ("turns", np.int32),
+    ("elapsed", np.float64),
+])
 
-    num_rows = len(game_map)
-    num_columns = len(game_map[0])
-    start_time = time.time()
-    Game(maxTurns,z,m,n)
-    end_time = time.time()
-    elapsed_time = end_time - start_time
-    print(f'Elapsed time: {elapsed_time:.3f} seconds, z = {z:.2f}, total turns = {TurnCounter}, maxTurns = {maxTurns}, wallProbability = {wallprob}')
-    agane = input("Would you like to simulate again? (Y/N)? ")
-    if agane == "Y" or agane == "y":
-        main()
-
-def Experiment(maxTurns=75,z=1,m=11,n=11,wallprob=0.2):
-    global num_columns,num_rows,game_map,TurnCounter,previousActR,previousActT
-    game_map = generate_random_map(m,n,wallprob)
-    num_rows = len(game_map)
-    num_columns = len(game_map[0])
-    score = 0        
-    with open("results.txt", "w") as f:
-        for i in range(1,7500):
+def Experiment(state,maxTurns=75,z=1,m=11,n=11,wallprob=0.2,directory="results",resume=True,checkpointEvery=50,games=7500):
+    # maxTurns grows with the score as the curriculum goes on. Every
+    # checkpointEvery games the game index, score, maxTurns and both random
+    # streams of state are checkpointed, so a killed run picks up where it was.
+    # Only a run with the same settings, solver settings of state included,
+    # may resume from a checkpoint.
+    config = {"z": z, "m": m, "n": n, "wallprob": wallprob, "games": games,
+              "sweepMode": state.sweepMode, "wavefrontSolve": state.wavefrontSolve,
+              "tolerance": state.tolerance, "warmStart": state.warmStart}
+    stream = ResultStream(directory, experimentDtype)
+    checkpoint = stream.resume() if resume else None
+    if checkpoint is None:
+        stream.clear()
+        generate_random_map(m,n,wallprob,state.mapRng)
+        first = 1
+        score = 0
+    else:
+        if checkpoint["config"] != config:
+            raise ValueError(f"The checkpoint in {directory} is for {checkpoint['config']}, not {config}")
+        first = checkpoint["game"]
+        score = checkpoint["score"]
+        maxTurns = checkpoint["maxTurns"]
+        state.mapRng.bit_generator.state = checkpoint["mapRng"]
+        state.randomStream.restore(checkpoint["randomStream"])
+        print(f"Resuming at game {first}, score = {score}")
+    with stream:
+        for i in range(first,games):
+            if (i - first) % checkpointEvery == 0:
+                stream.checkpoint({"config": config, "game": i, "score": score, "maxTurns": maxTurns,
+                                   "mapRng": state.mapRng.bit_generator.state, "randomStream": state.randomStream.state()})
             start_time = time.time()
-            maxTurns = 20-np.negative(np.ceil((score/20)))
-            scoreline = "score = " + str(score) + ", z = " + str(z+(i//10)) + ", maxTurns = " + str(maxTurns)
-            f.write(scoreline)
-            f.write("\n")
-            game_map = generate_random_map(m,n,wallprob)
-            score += Game(maxTurns,z+(i//10)-1,m,n)
+            maxTurns = 20 + int(np.ceil(score/20))
+            setMap(state, generate_random_map(m,n,wallprob,state.mapRng))
+            winner = Game(state,maxTurns,z+(i//10)-1)
             end_time = time.time()
             elapsed_time = end_time - start_time
-            print(f'Elapsed time: {elapsed_time:.3f} seconds, z = {z+i:.2f}, total turns = {TurnCounter}, maxTurns = {maxTurns}, wallProbability = {wallprob}')
-        f.write("End result: ", score)
+            stream.append((i, score, z+(i//10)-1, maxTurns, winner, state.TurnCounter, elapsed_time))
+            score += winner
+            print(f'Elapsed time: {elapsed_time:.3f} seconds, z = {z+i:.2f}, total turns = {state.TurnCounter}, maxTurns = {maxTurns}, wallProbability = {wallprob}')
+        stream.checkpoint({"config": config, "game": games, "score": score, "maxTurns": maxTurns,
+                           "mapRng": state.mapRng.bit_generator.state, "randomStream": state.randomStream.state()})
+    print(f"End result: {score}")
     return score
 
-# print(Experiment())
-main()
\ No newline at end of file
+def main(argv=None):
+    # Imported here so that importing the engine stays cheap.
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Play the tag game between a Runner and a Tagger.")
+    parser.add_argument("--max-turns", type=int, default=75, help="turns the Runner has to survive")
+    parser.add_argument("--z", type=int, default=10, help="Bellman iterations per turn")
+    parser.add_argument("--height", type=int, default=11)
+    parser.add_argument("--width", type=int, default=11)
+    parser.add_argument("--wall-prob", type=float, default=0.2)
+    parser.add_argument("--map", help="play on a text or binary map file instead of a random map")
+    parser.add_argument("--connected", action="store_true", help="wall off pockets the agents could not reach")
+    parser.add_argument("--games", type=int, default=1, help="games to play, each on a new map")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--sweep-mode", default="inplace")
+    parser.add_argument("--wavefront", action="store_true", help="solve uniform step-cost rewards with one BFS wavefront")
+    parser.add_argument("--tolerance", type=float, default=None)
+    parser.add_argument("--warm-start", action="store_true")
+    parser.add_argument("--no-cache", action="store_true", help="do not reuse solved Q tables")
+    parser.add_argument("--quiet", action="store_true", help="only print the results")
+    parser.add_argument("--experiment", action="store_true", help="run the curriculum Experiment instead")
+    parser.add_argument("--directory", default="results", help="where Experiment streams its results and checkpoints")
+    parser.add_argument("--restart", action="store_true", help="start the Experiment over instead of resuming it")
+    args = parser.parse_args(argv)
+
+    state = GameState(
+        seed=args.seed, sink=NullSink() if args.quiet else ConsoleSink(), sweepMode=args.sweep_mode,
+        wavefrontSolve=args.wavefront, tolerance=args.tolerance,
+        warmStart=args.warm_start, qCache=None if args.no_cache else QTableCache(),
+    )
+    if args.experiment:
+        Experiment(state, args.max_turns, args.z, args.height, args.width, args.wall_prob, args.directory, resume=not args.restart)
+        return 0
+    for _ in range(args.games):
+        if args.map:
+            game_map = load_game_map(args.map)
+        else:
+            game_map = generate_random_map(args.height, args.width, args.wall_prob, state.mapRng, args.connected)
+        if not args.quiet:
+            print("This will be your map for the game:")
+            print("-------------------------------------")
+            printMap(game_map,turnCounter=10)
+            print("-------------------------------------")
+        setMap(state, game_map)
+        start_time = time.time()
+        Game(state, args.max_turns, args.z)
+        end_time = time.time()
+        elapsed_time = end_time - start_time
+        print(f'Elapsed time: {elapsed_time:.3f} seconds, z = {args.z:.2f}, total turns = {state.TurnCounter}, maxTurns = {args.max_turns}, wallProbability = {args.wall_prob}')
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,251 +1,399 @@
 import numpy as np
-import random
+import os
 import time
+from bellman import BellmanSweeper, TiledSweeper, border_masks, terminal_masks
+from distances import UNREACHABLE, DistanceField
+from events import ConsoleSink, NullSink
+from joint import RUNNER, TAGGER, JointSolver
+from moves import ACTIONS, WAIT, MoveTable, action_name
+from placement import fill_pockets, place_agents
+from profiling import NO_PHASE
+from randomness import UniformStream, child_generators
+from storage import open_map, open_q_table, save_map
+
+class MapRow:
+    __slots__ = ("game_map", "y")
+
+    def __init__(self, game_map, y):
+        self.game_map = game_map
+        self.y = y
+
+    def __getitem__(self, x):
+        x = range(self.game_map.num_columns)[x]
+        for agent, position in self.game_map.agents.items():
+            if position == (self.y, x):
+                return agent
+        return '#' if self.game_map.walls[self.y, x] else ' '
+
+    def __len__(self):
+        return self.game_map.num_columns
+
+    def __iter__(self):
+        return (self[x] for x in range(self.game_map.num_columns))
+
+
+class MapView:
+    # Read-only map[y][x] character access for code written against the old
+    # list-of-lists map. Nothing is copied; characters are made on access.
+    __slots__ = ("game_map",)
+
+    def __init__(self, game_map):
+        self.game_map = game_map
+
+    def __getitem__(self, y):
+        return MapRow(self.game_map, range(self.game_map.num_rows)[y])
+
+    def __len__(self):
+        return self.game_map.num_rows
+
+    def __iter__(self):
+        return (self[y] for y in range(self.game_map.num_rows))
+
 
 class GameMap:
-    def __init__(self, num_rows, num_columns, wall_probability):
+    def __init__(self, num_rows, num_columns, wall_probability, rng=None, connected=False):
         self.num_rows = num_rows
         self.num_columns = num_columns
         self.wall_probability = wall_probability
-        self.map = self.generate_random_map()
-    
-    def generate_random_map(self):
-        game_map = []
-        for i in range(self.num_rows):
-            row = []
-            for j in range(self.num_columns):
-                if i == 0 or i == self.num_rows - 1 or j == 0 or j == self.num_columns - 1:
-                    row.append("#")
-                elif random.random() < self.wall_probability:
-                    row.append("#")
-                else:
-                    row.append(" ")
-            game_map.append(row)
-        self.place_agents(game_map)
+        self.rng = np.random.default_rng(rng)
+        # connected walls off every pocket outside the largest open area, so
+        # all free cells of the map can reach each other.
+        self.connected = connected
+        # Agent coordinates are the source of truth; walls is a bool grid
+        # (one byte per cell) and characters are only produced for display.
+        self.agents = {}
+        self.walls = self.generate_random_map()
+        self._distance_field = None
+        self._move_table = None
+
+    @classmethod
+    def from_walls(cls, walls, agents):
+        # A map over an existing wall grid with the agents at the given
+        # {"R": (y, x), "T": (y, x)} positions.
+        game_map = cls.__new__(cls)
+        game_map.num_rows, game_map.num_columns = walls.shape
+        game_map.wall_probability = None
+        game_map.rng = np.random.default_rng()
+        game_map.connected = False
+        game_map.agents = dict(agents)
+        game_map.walls = walls
+        game_map._distance_field = None
+        game_map._move_table = None
         return game_map
 
-    def place_agents(self, game_map):
-        r_row, r_col = self.get_random_position()
-        game_map[r_row][r_col] = "R"
-        t_row, t_col = self.get_random_position()
-        while (t_row, t_col) == (r_row, r_col) or abs(t_row - r_row) <= 2 or abs(t_col - r_col) <= 2:
-            t_row, t_col = self.get_random_position()
-        game_map[t_row][t_col] = "T"
+    @classmethod
+    def from_file(cls, path):
+        # Opens a map written by save (storage.py format). The walls stay
+        # bit-packed in a memory-mapped file and rows are unpacked on access.
+        return cls.from_walls(*open_map(path))
+
+    def save(self, path):
+        save_map(path, self.walls, self.agents)
+
+    def generate_random_map(self):
+        shape = (self.num_rows, self.num_columns)
+        walls = self.rng.random(shape, dtype=np.float32) < self.wall_probability
+        walls[[0, -1], :] = True
+        walls[:, [0, -1]] = True
+        components = fill_pockets(walls) if self.connected else None
+        self.place_agents(walls, components)
+        return walls
+
+    def place_agents(self, walls, components=None):
+        # Both agents start on free cells of one connected area, far enough
+        # apart (see placement.place_agents).
+        self.agents["R"], self.agents["T"] = place_agents(walls, self.rng, components)
 
     def get_random_position(self):
-        return random.randint(1, self.num_rows - 2), random.randint(1, self.num_columns - 2)
+        return int(self.rng.integers(1, self.num_rows - 1)), int(self.rng.integers(1, self.num_columns - 1))
 
     def find_agent_location(self, agent):
-        for i in range(self.num_rows):
-            for j in range(self.num_columns):
-                if self.map[i][j] == agent:
-                    return (i, j)
-        return None
+        return self.agents.get(agent)
+
+    def move_agent(self, agent, y, x):
+        self.agents[agent] = (y, x)
+
+    @property
+    def map(self):
+        return MapView(self)
+
+    def render(self):
+        game_map = np.where(self.walls, '#', ' ')
+        for agent, (y, x) in self.agents.items():
+            game_map[y, x] = agent
+        return game_map.tolist()
 
     def is_wall(self, y, x):
-        return self.map[y][x] == '#'
+        return bool(self.walls[y, x])
+
+    @property
+    def distance_field(self):
+        # Walls never change during a game, so the BFS distances are built
+        # once per map and shared by both agents.
+        if self._distance_field is None:
+            self._distance_field = DistanceField(self.walls)
+        return self._distance_field
+
+    @property
+    def move_table(self):
+        # Built on the distance field's bool walls, so packed walls
+        # (from_file) are only unpacked once.
+        if self._move_table is None:
+            self._move_table = MoveTable(self.distance_field.walls)
+        return self._move_table
 
     def print_map(self, turn_counter=10):
         if turn_counter > 0:
-            for row in self.map:
+            for row in self.render():
                 print(' '.join(row))
 
 
 class Agent:
+    # Whether incremental games warm-start this agent's sweeps.
+    warm_start = True
+
     def __init__(self, name, game_map, game):
         self.name = name
         self.game_map = game_map
         self.game = game
-        self.previous_action = None
-        self.q_sa = np.zeros((self.game_map.num_rows, self.game_map.num_columns))
+        self.previous_action = WAIT
+        shape = (self.game_map.num_rows, self.game_map.num_columns)
+        self.scratch = None
+        if game.q_directory is None:
+            self.q_sa = np.zeros(shape)
+        else:
+            # The second buffer of TiledSweeper's double buffering stays on
+            # disk next to the table.
+            self.q_sa = open_q_table(os.path.join(game.q_directory, name + ".npy"), shape)
+            self.scratch = open_q_table(os.path.join(game.q_directory, name + ".scratch.npy"), shape)
 
     def act(self, action):
-        y, x = self.game_map.find_agent_location(self.name)
-        new_y, new_x = self.get_new_position(y, x, action)
-        if new_y is not None and not self.game_map.is_wall(new_y, new_x):
-            self.game_map.map[y][x] = " "
-            self.game_map.map[new_y][new_x] = self.name
+        # action is an index into ACTIONS, or WAIT.
+        table = self.game_map.move_table
+        cell = table.cell(*self.game_map.find_agent_location(self.name))
+        if action in table.options(cell, self.previous_action):
+            self.game_map.move_agent(self.name, *table.position(cell, action))
             return True
         return False
 
-    def get_new_position(self, y, x, action):
-        new_y, new_x = None, None
-        if action == "up" and self.previous_action != "down" and y > 0:
-            new_y, new_x = y - 1, x
-        elif action == "down" and self.previous_action != "up" and y < self.game_map.num_rows - 1:
-            new_y, new_x = y + 1, x
-        elif action == "right" and self.previous_action != "left" and x < self.game_map.num_columns - 1:
-            new_y, new_x = y, x + 1
-        elif action == "left" and self.previous_action != "right" and x > 0:
-            new_y, new_x = y, x - 1
-        
-        if new_y is not None and not self.game_map.is_wall(new_y, new_x):
-            return new_y, new_x
-        return None, None
+    def move_options(self):
+        # This agent's free cell id and which actions it may take from there.
+        table = self.game_map.move_table
+        cell = table.cell(*self.game_map.find_agent_location(self.name))
+        return cell, table.options(cell, self.previous_action)
 
     def reward_function(self):
         raise NotImplementedError
 
-    def q_value_update(self, iterations, gamma=1):
-        raise NotImplementedError
+    def q_value_update(self, iterations, gamma=1, tolerance=None):
+        # The reward grid does not change during the sweeps, so it is built
+        # once and every sweep is O(rows * columns): O(iterations * rows *
+        # columns) per update. The interior is relaxed, the border kept and
+        # the agent's own cell pinned to 0.
+        with self.game.phase("reward"):
+            reward_list = self.reward_function()
+        with self.game.phase("sweeps"):
+            if self.game.q_directory is not None:
+                # Memory-mapped tables are swept a few tiles of rows at a time.
+                sweeper = TiledSweeper(self.q_sa.shape, self.game_map.find_agent_location(self.name), gamma=gamma)
+                return sweeper.solve(self.q_sa, reward_list, iterations, tolerance, scratch=self.scratch)
+            if self.game.solver == "wavefront":
+                report = self.wavefront(reward_list, gamma)
+                if report is not None:
+                    return report
+            masks = border_masks(self.q_sa.shape, self.game_map.find_agent_location(self.name))
+            sweeper = BellmanSweeper(*masks, gamma=gamma, mode=self.game.sweep_mode)
+            return self.run_sweeps(sweeper, reward_list, iterations, tolerance)
+
+    def wavefront(self, reward_list, gamma=1):
+        # The exact table in one BFS (BellmanSweeper.wavefront), or None when
+        # the rewards are not a uniform step cost. The Runner's never are.
+        masks = border_masks(self.q_sa.shape, self.game_map.find_agent_location(self.name))
+        return BellmanSweeper(*masks, gamma=gamma).wavefront(self.q_sa, reward_list)
+
+    def run_sweeps(self, sweeper, reward_list, iterations, tolerance=None):
+        # q_sa survives between turns, so in incremental mode only the cells
+        # disturbed by the last move are relaxed again (see
+        # BellmanSweeper.relax), for agents whose rewards allow it.
+        if self.game.incremental and self.warm_start:
+            return sweeper.relax(self.q_sa, reward_list, iterations, tolerance)
+        return sweeper.solve(self.q_sa, reward_list, iterations, tolerance)
+
+    def joint_action(self, solver):
+        # O(1) lookup in a solved joint-state policy; the joint planner is
+        # already optimal against the opponent, so it neither explores nor waits.
+        mover = RUNNER if self.name == "R" else TAGGER
+        runner, tagger = self.game_map.agents["R"], self.game_map.agents["T"]
+        action = solver.action(mover, runner, tagger, self.previous_action)
+        self.game.sink.action(self.name, "best", action_name(action), self.game.turn_counter, solver.value(mover, runner, tagger))
+        return action
 
     def best_action(self, epsilon=0.05, alpha=0.95):
-        y, x = self.game_map.find_agent_location(self.name)
-        best_move = None
-        top_q = -999999
-        actions = ["up", "down", "left", "right"]
-
-        if np.random.uniform() > alpha:
-            print(f'The agent {self.name} has chosen an awaiting move: {best_move}, Turn = {self.game.turn_counter}')
-            return best_move
-
-        if np.random.uniform() < epsilon:
-            best_move = random.choice(actions)
-            if self.get_new_position(y, x, best_move) != (None, None):
-                print(f'The agent {self.name} has chosen a random exploration move: {best_move}, Turn = {self.game.turn_counter}')
-                return best_move
-
-        for action in actions:
-            new_y, new_x = self.get_new_position(y, x, action)
-            if new_y is not None:
-                current_q = self.q_sa[new_y][new_x]
-                if current_q >= top_q:
-                    top_q = current_q
-                    best_move = action
-
-        print(f'The agent {self.name} has chosen the best move: {best_move}, Turn = {self.game.turn_counter}, Q_sa = {top_q:.3f}')
-        return best_move
+        cell, options = self.move_options()
+        draws = self.game.draws
+        if draws.uniform() > alpha:
+            self.game.sink.action(self.name, "awaiting", None, self.game.turn_counter)
+            return WAIT
+
+        # A blocked exploration move is still returned when no move is
+        # allowed at all (it then fails in act but counts as previous_action).
+        fallback = WAIT
+        if draws.uniform() < epsilon:
+            fallback = draws.integers(len(ACTIONS))
+            if fallback in options:
+                self.game.sink.action(self.name, "exploration", ACTIONS[fallback], self.game.turn_counter)
+                return fallback
+
+        # Ties go to the last best action and nothing below -999999 is taken.
+        action, top_q = self.game_map.move_table.greedy(self.q_sa, cell, options, floor=-999999, last=True)
+        if action == WAIT:
+            action = fallback
+        self.game.sink.action(self.name, "best", action_name(action), self.game.turn_counter, top_q)
+        return action
 
 
 class Runner(Agent):
     def reward_function(self):
-        reward_list = np.zeros((self.game_map.num_rows, self.game_map.num_columns))
         y, x = self.game_map.find_agent_location("T")
-        max_distance = (self.game_map.num_rows + self.game_map.num_columns - 2)
-        for i in range(self.game_map.num_rows):
-            for j in range(self.game_map.num_columns):
-                distance = abs(i - y) + abs(j - x)
-                reward_list[i][j] = -(max_distance-distance)  # Runner wants to maximize the distance, so we use negative distance
-        return reward_list
-
-    def q_value_update(self, iterations, gamma=1):
-        reward_list = self.reward_function()
-        for _ in range(iterations):
-            for i in range(1, self.game_map.num_rows - 1):
-                for j in range(1, self.game_map.num_columns - 1):
-                    if self.game_map.map[i][j] == "R":
-                        self.q_sa[i][j] = 0
-                    else:
-                        neighbors_q_values = []
-                        if i > 0:
-                            neighbors_q_values.append(self.q_sa[i-1][j])
-                        if i < self.game_map.num_rows - 1:
-                            neighbors_q_values.append(self.q_sa[i+1][j])
-                        if j > 0:
-                            neighbors_q_values.append(self.q_sa[i][j-1])
-                        if j < self.game_map.num_columns - 1:
-                            neighbors_q_values.append(self.q_sa[i][j+1])
-
-                        if neighbors_q_values:
-                            self.q_sa[i][j] = reward_list[i][j] + gamma * max(neighbors_q_values)
-                        else:
-                            self.q_sa[i][j] = reward_list[i][j]
+        distance = self.game_map.distance_field.grid(y, x).astype(float)
+        # Cells the tagger can never reach (walls included) score like the
+        # tagger's own cell.
+        distance[distance == UNREACHABLE] = 0
+        max_distance = max(self.game_map.num_rows + self.game_map.num_columns - 2, distance.max())
+        return -(max_distance - distance)  # Runner wants to maximize the distance, so we use negative distance
 
     def best_action(self, epsilon=0.05, alpha=0.95):
-        y, x = self.game_map.find_agent_location(self.name)
-        best_move = None
-        top_q = -np.inf
-        actions = ["up", "down", "left", "right"]
-
-        if np.random.uniform() < epsilon:
-            best_move = random.choice(actions)
-            new_y, new_x = self.get_new_position(y, x, best_move)
-            if new_y is not None:
-                print(f'The agent {self.name} has chosen a random exploration move: {best_move}, Turn = {self.game.turn_counter}')
-                return best_move
-
-        for action in actions:
-            new_y, new_x = self.get_new_position(y, x, action)
-            if new_y is not None:
-                current_q = self.q_sa[new_y][new_x]
-                if current_q > top_q:
-                    top_q = current_q
-                    best_move = action
-
-        print(f'The agent {self.name} has chosen the best move: {best_move}, Turn = {self.game.turn_counter}, Q_sa = {top_q:.3f}')
-        return best_move
+        cell, options = self.move_options()
+        draws = self.game.draws
+        # A blocked exploration move is still returned when no move is
+        # allowed at all (it then fails in act but counts as previous_action).
+        fallback = WAIT
+        if draws.uniform() < epsilon:
+            fallback = draws.integers(len(ACTIONS))
+            if fallback in options:
+                self.game.sink.action(self.name, "exploration", ACTIONS[fallback], self.game.turn_counter)
+                return fallback
+
+        # The Runner never waits on purpose and ties go to the first best action.
+        action, top_q = self.game_map.move_table.greedy(self.q_sa, cell, options)
+        if action == WAIT:
+            action = fallback
+        self.game.sink.action(self.name, "best", action_name(action), self.game.turn_counter, top_q)
+        return action
 
 class Tagger(Agent):
+    # At gamma 1 the two cells next to and on the Runner gain value on every
+    # lap between them, so the Tagger's table never settles and there is no
+    # fixed point to warm-start towards: it is always swept from q_sa.
+    warm_start = False
+
+    def wavefront(self, reward_list, gamma=1):
+        # A tag ends the game, so the Runner's cell and its free neighbours
+        # are terminal; with the walls pinned out every other step costs 1
+        # and the table is 1 - the distance to the Runner.
+        sweeper = BellmanSweeper(*terminal_masks(reward_list), gamma=gamma, walls=self.game_map.distance_field.walls)
+        return sweeper.wavefront(self.q_sa, reward_list)
+
     def reward_function(self):
-        reward_list = np.zeros((self.game_map.num_rows, self.game_map.num_columns))
-        y, x = self.game_map.find_agent_location("R")
+        field = self.game_map.distance_field
+        distance = field.grid(*self.game_map.find_agent_location("R"))
         reward = 1
 
-        for i in range(self.game_map.num_rows):
-            for j in range(self.game_map.num_columns):
-                distance = abs(i - y) + abs(j - x)
-                if distance == 1:
-                    reward_list[i][j] = reward - 1
-                elif distance == 0:
-                    reward_list[i][j] = reward
-                else:
-                    reward_list[i][j] = -1
-                    if self.game_map.is_wall(i, j):
-                        reward_list[i][j] = -3
-
+        reward_list = np.full(distance.shape, -1.0)
+        reward_list[field.walls] = -3
+        reward_list[distance == 1] = reward - 1
+        reward_list[distance == 0] = reward
         return reward_list
 
-    def q_value_update(self, iterations, gamma=1):
-        for _ in range(iterations):
-            for i in range(self.game_map.num_rows-1):
-                for j in range(self.game_map.num_columns-1):
-                    if self.game_map.map[i][j] == "T":
-                        self.q_sa[i][j] = 0
-                    else:
-                        self.q_sa[i][j] = self.reward_function()[i][j] + gamma * max(
-                            self.q_sa[i - 1][j], self.q_sa[i + 1][j], self.q_sa[i][j - 1], self.q_sa[i][j + 1]
-                        )
-
 
 class Game:
-    def __init__(self, max_turns, iterations, map_height, map_width, wall_prob):
+    def __init__(self, max_turns, iterations, map_height, map_width, wall_prob, sweep_mode="inplace", tolerance=None, incremental=False, rng=None, sink=None, solver="sweeps", game_map=None, q_directory=None, stats=None, connected=False):
         self.max_turns = max_turns
+        # Where turn events go; nothing is formatted unless a sink wants it.
+        self.sink = NullSink() if sink is None else sink
+        # With a tolerance, iterations is only a cap: the sweeps stop as soon
+        # as the Q table stops changing.
         self.iterations = iterations
+        self.tolerance = tolerance
+        self.sweep_mode = sweep_mode
+        self.incremental = incremental
+        self.sweep_report = None
         self.turn_counter = 0
-        self.game_map = GameMap(map_height, map_width, wall_prob)
+        # game_map plays on an existing map (e.g. GameMap.from_file) instead of
+        # a random one; q_directory keeps the Q tables there as float32 memmaps,
+        # swept by bellman.TiledSweeper ("jacobi" order, whatever sweep_mode,
+        # incremental and the wavefront solver say).
+        self.q_directory = q_directory
+        # rng seeds the whole game: an int, a SeedSequence or a Generator. The
+        # map and the agents' epsilon/alpha draws get independent children of
+        # it, so the same seed replays the same game bit for bit.
+        map_rng, play_rng = child_generators(rng, 2)
+        self.draws = UniformStream(play_rng)
+        self.game_map = GameMap(map_height, map_width, wall_prob, map_rng, connected) if game_map is None else game_map
+        # stats (a profiling.GameStats) turns on per-phase timing and the
+        # per-turn trace; without it the phases cost one None check each.
+        self.stats = stats
+        if stats is not None:
+            stats.count_calls(self.game_map)
         self.runner = Runner("R", self.game_map, self)
         self.tagger = Tagger("T", self.game_map, self)
+        # solver="joint" solves the whole map once up front instead of
+        # sweeping a fresh Q table every turn. solver="wavefront" finds the
+        # exact Q table in one BFS pass whenever the rewards are a uniform
+        # step cost (Agent.wavefront): always for the Tagger, never for the
+        # Runner, whose table is swept.
+        self.solver = solver
+        self.joint_solver = None
+        if solver == "joint":
+            self.joint_solver = JointSolver(self.game_map.walls)
+            self.sweep_report = self.joint_solver.solve(horizon=max_turns)
+        elif solver not in ("sweeps", "wavefront"):
+            raise ValueError(f"Unknown solver {solver!r}, expected 'sweeps', 'wavefront' or 'joint'")
 
     def terminal(self):
         y_r, x_r = self.game_map.find_agent_location("R")
         y_t, x_t = self.game_map.find_agent_location("T")
         if abs(y_r - y_t) + abs(x_r - x_t) == 1:
-            print("Player Tag has won the game!")
             return True
         return False
 
+    def phase(self, name):
+        return NO_PHASE if self.stats is None else self.stats.phase(name)
+
+    def plan(self, agent):
+        if self.joint_solver is not None:
+            with self.phase("action"):
+                return agent.joint_action(self.joint_solver)
+        self.sweep_report = agent.q_value_update(self.iterations, tolerance=self.tolerance)
+        with self.phase("action"):
+            return agent.best_action()
+
+    def to_move(self):
+        return self.runner if self.turn_counter % 2 == 0 else self.tagger
+
     def play_turn(self):
-        if self.turn_counter % 2 == 0:
-            self.runner.q_value_update(self.iterations)
-            best_act = self.runner.best_action()
-            self.runner.act(best_act)
-            self.runner.previous_action = best_act
-        else:
-            self.tagger.q_value_update(self.iterations)
-            best_act = self.tagger.best_action()
-            self.tagger.act(best_act)
-            self.tagger.previous_action = best_act
+        agent = self.to_move()
+        if self.stats is not None:
+            self.stats.begin_turn(self.turn_counter + 1, agent.name)
+        self.finish_turn(agent, self.plan(agent))
+
+    def finish_turn(self, agent, best_act):
+        # Applies the mover's chosen action (WAIT waits) and ends the turn.
+        with self.phase("move"):
+            agent.act(best_act)
+            agent.previous_action = best_act
         self.turn_counter += 1
-        print("-" * (self.game_map.num_columns * 2))
-        self.game_map.print_map(self.turn_counter)
+        with self.phase("render"):
+            self.sink.turn(self.turn_counter, self.game_map.agents, self.game_map.render)
+        if self.stats is not None:
+            self.stats.end_turn(self.sweep_report if self.joint_solver is None else None, agent.q_sa)
 
     def run(self):
         while not self.terminal() and self.turn_counter < self.max_turns:
             self.play_turn()
-        if self.turn_counter >= self.max_turns:
-            print("Player Run has won the game!")
-            return 1
-        return -1
+        winner = 1 if self.turn_counter >= self.max_turns else -1
+        self.sink.result(winner, self.turn_counter)
+        return winner
 
 
 def main():
@@ -258,14 +406,14 @@ def main():
     map_width = int(input("Width = "))
     wall_prob = float(input("Wall probability (0 to 1) = "))
 
-    game = Game(max_turns, iterations, map_height, map_width, wall_prob)
+    game = Game(max_turns, iterations, map_height, map_width, wall_prob, sink=ConsoleSink())
     print("This will be your map for the game:")
     print("-------------------------------------")
     game.game_map.print_map(turn_counter=10)
     print("-------------------------------------")
     print("Do you wish to regenerate the map?")
     if input("Y/N? ") == "Y":
-        game = Game(max_turns, iterations, map_height, map_width, wall_prob)
+        game = Game(max_turns, iterations, map_height, map_width, wall_prob, sink=ConsoleSink())
 
     start_time = time.time()
     game.run()
@@ -0,0 +1,310 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import tagMDP
+from bellman import SWEEP_MODES, BellmanSweeper, TiledSweeper, border_masks
+from distances import UNREACHABLE, DistanceField, label_components
+from joint import JointSolver
+from placement import MIN_OFFSET, tagger_choices
+from server import WATCH_BUFFER, GameServer, Session
+from tagmdp_2 import Game, GameMap
+
+# Parity of the "inplace" sweeps with the original triple loops, which are
+# kept here verbatim (apart from taking the map and rewards as arguments) as
+# the reference.
+
+SEEDS = range(10)
+
+
+def reference_q_value_run(game_map, reward_list_run, z, gamma=1):
+    num_rows, num_columns = len(game_map), len(game_map[0])
+    Q_sa = np.zeros([num_rows, num_columns])
+    for i in range(z):
+        for i in range(num_rows):
+            for j in range(num_columns):
+                if j == 0 or j == num_columns-1:
+                    Q_sa[i][j] = -10
+                elif i == 0 or i == num_rows-1:
+                    Q_sa[i][j] = -10
+                elif game_map[i][j] == "R":
+                    Q_sa[i][j] = 0
+                else:
+                    Q_sa[i][j] = reward_list_run[i][j] + gamma * max(Q_sa[i-1][j], Q_sa[i+1][j], Q_sa[i][j-1], Q_sa[i][j+1])
+    return Q_sa
+
+
+def reference_q_value_tag(game_map, reward_list_tagger, z, gamma=1):
+    num_rows, num_columns = len(game_map), len(game_map[0])
+    Q_sa = np.zeros([num_rows, num_columns])
+    for i in range(z):
+        for i in range(num_rows):
+            for j in range(num_columns):
+                if j == 0 or j == num_columns-1:
+                    Q_sa[i][j] = -10
+                elif i == 0 or i == num_rows-1:
+                    Q_sa[i][j] = -10
+                elif game_map[i][j] == "T":
+                    Q_sa[i][j] = 0
+                else:
+                    Q_sa[i][j] = reward_list_tagger[i][j] + gamma * max(Q_sa[i-1][j], Q_sa[i+1][j], Q_sa[i][j-1], Q_sa[i][j+1])
+    return Q_sa
+
+
+def reference_runner_update(q_sa, game_map, reward_list, iterations, gamma=1):
+    num_rows, num_columns = len(game_map), len(game_map[0])
+    for _ in range(iterations):
+        for i in range(1, num_rows - 1):
+            for j in range(1, num_columns - 1):
+                if game_map[i][j] == "R":
+                    q_sa[i][j] = 0
+                else:
+                    neighbors_q_values = []
+                    if i > 0:
+                        neighbors_q_values.append(q_sa[i-1][j])
+                    if i < num_rows - 1:
+                        neighbors_q_values.append(q_sa[i+1][j])
+                    if j > 0:
+                        neighbors_q_values.append(q_sa[i][j-1])
+                    if j < num_columns - 1:
+                        neighbors_q_values.append(q_sa[i][j+1])
+
+                    if neighbors_q_values:
+                        q_sa[i][j] = reward_list[i][j] + gamma * max(neighbors_q_values)
+                    else:
+                        q_sa[i][j] = reward_list[i][j]
+    return q_sa
+
+
+def legacy_state(seed, num_rows=13, num_columns=17, wall_probability=0.3):
+    state = tagMDP.GameState(seed)
+    tagMDP.setMap(state, tagMDP.generate_random_map(num_rows, num_columns, wall_probability, state.mapRng))
+    return state
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("z", [1, 7, 40])
+def test_q_value_run_matches_loops(seed, z):
+    state = legacy_state(seed)
+    reward = tagMDP.rewardFunctionRun(state)
+    expected = reference_q_value_run(state.game_map, reward, z)
+    np.testing.assert_array_equal(tagMDP.Q_value_Run(state, reward, z), expected)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("z", [1, 7, 40])
+def test_q_value_tag_matches_loops(seed, z):
+    state = legacy_state(seed)
+    reward = tagMDP.rewardFunctionTag(state)
+    expected = reference_q_value_tag(state.game_map, reward, z)
+    np.testing.assert_array_equal(tagMDP.Q_value_Tag(state, reward, z), expected)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_sweeper_matches_loops_on_random_rewards(seed):
+    rng = np.random.default_rng(seed)
+    state = legacy_state(seed, 9, 23)
+    reward = rng.integers(-20, 20, (9, 23)).astype(float)
+    sweeper = BellmanSweeper(*border_masks((9, 23), tagMDP.find_agent_location(state, "R"), border_value=-10), mode="inplace")
+    q_sa = np.zeros((9, 23))
+    sweeper.solve(q_sa, reward, 15)
+    np.testing.assert_array_equal(q_sa, reference_q_value_run(state.game_map, reward, 15))
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_runner_update_matches_loops(seed):
+    game = Game(20, 10, 12, 15, 0.3, rng=seed)
+    runner = game.runner
+    # Start from a non-zero (integral, like every game's) table so the kept
+    # border cells matter too.
+    runner.q_sa[...] = np.random.default_rng(seed).integers(-30, 30, runner.q_sa.shape)
+    expected = reference_runner_update(runner.q_sa.copy(), game.game_map.render(), runner.reward_function(), 10)
+    runner.q_value_update(10)
+    np.testing.assert_array_equal(runner.q_sa, expected)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_relax_reaches_the_solved_table(seed):
+    # Warm-started from the table of another goal, relax settles on the same
+    # fixed point as cold sweeps to convergence.
+    rng = np.random.default_rng(seed)
+    reward = -rng.integers(1, 5, (15, 19)).astype(float)
+    old = BellmanSweeper(*border_masks((15, 19), (3, 4), border_value=-10), mode="jacobi")
+    new = BellmanSweeper(*border_masks((15, 19), (10, 12), border_value=-10), mode="jacobi")
+    warm = np.zeros((15, 19))
+    old.solve(warm, reward, 1000, tolerance=0)
+    cold = np.zeros((15, 19))
+    new.solve(cold, reward, 1000, tolerance=0)
+    report = new.relax(warm, reward, 1000, tolerance=0)
+    assert report.converged
+    np.testing.assert_array_equal(warm, cold)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_incremental_games_only_warm_start_the_runner(seed):
+    # The Tagger's rewards never settle, so incremental games sweep its
+    # table exactly as plain ones do; the Runner's table is relaxed instead.
+    games = [Game(20, 10, 12, 15, 0.3, rng=seed, incremental=incremental) for incremental in (False, True)]
+    for game in games:
+        game.play_turn()
+        game.tagger.q_value_update(10)
+    np.testing.assert_array_equal(games[0].tagger.q_sa, games[1].tagger.q_sa)
+    assert games[1].runner.q_value_update(10).converged
+
+
+@pytest.mark.filterwarnings("error")
+@pytest.mark.parametrize("mode", SWEEP_MODES)
+def test_walls_sweep_without_warnings(mode):
+    # Walls and the dead ends they cut off stay at -inf; their -inf - -inf
+    # changes are not warned about.
+    walls = np.zeros((9, 9), dtype=bool)
+    walls[[5, 7, 6, 6], [4, 4, 3, 5]] = True
+    sweeper = BellmanSweeper(*border_masks((9, 9), (1, 1), border_value=-10), mode=mode, walls=walls)
+    q_sa = np.zeros((9, 9))
+    reward = np.full((9, 9), -1.0)
+    assert sweeper.solve(q_sa, reward, 50, tolerance=0).converged
+    assert np.isneginf(q_sa[6, 4])
+    assert sweeper.relax(q_sa, reward, 50).converged
+    tiled = np.zeros((9, 9))
+    assert TiledSweeper((9, 9), (1, 1), border_value=-10, walls=walls).solve(tiled, reward, 50, tolerance=0).converged
+
+
+def reference_joint_values(solver, horizon):
+    # Minimax value iteration over (runner cell, tagger cell) one state at a
+    # time, on the solver's free cell graph.
+    count = solver.cells.size
+    successors = [[int(n) for n in row if n >= 0] or [c] for c, row in enumerate(solver.neighbours)]
+    runner, tagger = np.zeros((count, count)), np.zeros((count, count))
+    for _ in range(horizon + 1):
+        new_runner = np.array([[max(tagger[s, t] for s in successors[r]) for t in range(count)] for r in range(count)])
+        new_runner = np.where(solver.terminal, 0, np.minimum(new_runner + 1, horizon))
+        new_tagger = np.array([[min(new_runner[r, s] for s in successors[t]) for t in range(count)] for r in range(count)])
+        new_tagger = np.where(solver.terminal, 0, np.minimum(new_tagger + 1, horizon))
+        runner, tagger = new_runner, new_tagger
+    return runner, tagger
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_joint_solver_matches_reference(seed):
+    game = Game(20, 10, 8, 9, 0.3, rng=seed)
+    solver = JointSolver(game.game_map.walls, block_bytes=64)
+    report = solver.solve(horizon=12)
+    assert report.converged
+    for table, expected in zip(solver.values, reference_joint_values(solver, 12)):
+        np.testing.assert_array_equal(table, expected)
+
+
+@pytest.mark.parametrize("seed", SEEDS[:3])
+def test_memory_mapped_tables_sweep_in_tiles(seed, tmp_path):
+    # q_directory tables go through TiledSweeper and match in-RAM jacobi
+    # sweeps (the values are integers, exact in float32).
+    games = [Game(20, 10, 12, 15, 0.3, sweep_mode="jacobi", rng=seed, q_directory=directory) for directory in (None, tmp_path)]
+    for game in games:
+        game.runner.q_value_update(10)
+        game.tagger.q_value_update(10)
+    assert isinstance(games[1].runner.q_sa, np.memmap)
+    np.testing.assert_array_equal(games[0].runner.q_sa, games[1].runner.q_sa)
+    np.testing.assert_array_equal(games[0].tagger.q_sa, games[1].tagger.q_sa)
+
+
+@pytest.mark.parametrize("seed", SEEDS[:3])
+def test_legacy_memory_mapped_tables_sweep_in_tiles(seed, tmp_path):
+    states = [legacy_state(seed) for _ in range(2)]
+    states[0].sweepMode = "jacobi"
+    states[1].qDirectory = str(tmp_path)
+    for state in states:
+        reward = tagMDP.rewardFunctionRun(state)
+        Q_run = tagMDP.Q_value_Run(state, reward, 7)
+        Q_run = tagMDP.Q_value_Run(state, reward, 7, tolerance=0, previous=Q_run)
+    assert isinstance(Q_run, np.memmap)
+    np.testing.assert_array_equal(tagMDP.Q_value_Run(states[0], reward, 7), tagMDP.Q_value_Run(states[1], reward, 7))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_tagger_choices_match_brute_force(seed):
+    # A free interior cell has a Tagger cell iff some cell it can reach lies
+    # MIN_OFFSET or more rows and columns away.
+    rng = np.random.default_rng(seed)
+    walls = rng.random(rng.integers(6, 25, 2)) < rng.random() * 0.7
+    walls[[0, -1], :] = True
+    walls[:, [0, -1]] = True
+    labels, count = label_components(walls)
+    field = DistanceField(walls)
+    y, x, cell_labels, far = tagger_choices(walls)
+    for cell, (row, column) in enumerate(zip(y, x)):
+        reachable = field.grid(row, column) < UNREACHABLE
+        rows, columns = np.nonzero(reachable)
+        expected = ((np.abs(rows - row) >= MIN_OFFSET) & (np.abs(columns - column) >= MIN_OFFSET)).any()
+        assert far[cell] == expected
+        assert (labels == cell_labels[cell]).sum() == reachable.sum()
+    assert count == len(np.unique(labels[labels >= 0]))
+
+
+@pytest.mark.parametrize("key", ["height", "width", "iterations", "max_turns"])
+@pytest.mark.parametrize("value", [0, 101, 2.5, True])
+def test_new_sessions_are_bounded(key, value):
+    game_server = GameServer(1, max_map_size=100, max_iterations=100, max_turns=100)
+    try:
+        with pytest.raises(ValueError, match=key):
+            asyncio.run(game_server.op_new({"op": "new", key: value}, None))
+    finally:
+        game_server.close()
+
+
+class StalledWriter:
+    # A watcher connection that never reads: everything written stays queued.
+    def __init__(self):
+        self.transport = self
+        self.queued = 0
+
+    def is_closing(self):
+        return False
+
+    def get_write_buffer_size(self):
+        return self.queued
+
+    def write(self, data):
+        self.queued += len(data)
+
+
+def test_stalled_watchers_are_dropped():
+    config = {"max_turns": 75, "iterations": 10, "height": 11, "width": 11, "wall_prob": 0.2, "seed": 0, "sweep_mode": "inplace", "tolerance": None, "human": None}
+    session = Session(1, config, GameMap(11, 11, 0.2, 0))
+    writer = StalledWriter()
+    session.watchers.add(writer)
+    while writer in session.watchers:
+        session.broadcast({"event": "turn", "padding": "x" * 1000})
+    assert WATCH_BUFFER < writer.queued <= WATCH_BUFFER + 2000
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_wavefront_games_solve_the_tagger_in_one_pass(seed):
+    # The Tagger's table is exact: 1 - the distance to the Runner wherever
+    # the Tagger can get to it, -inf elsewhere. The Runner's rewards are not
+    # a uniform step cost, so its table is swept as in plain games.
+    games = [Game(20, 10, 12, 15, 0.3, rng=seed, solver=solver) for solver in ("sweeps", "wavefront")]
+    for game in games:
+        game.play_turn()
+    game = games[1]
+    report = game.tagger.q_value_update(10)
+    distance = game.game_map.distance_field.grid(*game.game_map.find_agent_location("R"))
+    reachable = distance != UNREACHABLE
+    expected = np.where(reachable, 1.0 - distance, -np.inf)
+    assert report.converged
+    np.testing.assert_array_equal(game.tagger.q_sa, expected)
+    np.testing.assert_array_equal(games[0].runner.q_value_update(10).sweeps, games[1].runner.q_value_update(10).sweeps)
+    np.testing.assert_array_equal(games[0].runner.q_sa, games[1].runner.q_sa)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_legacy_wavefront_solves_the_tagger_in_one_pass(seed):
+    state = legacy_state(seed)
+    state.wavefrontSolve = True
+    reward = tagMDP.rewardFunctionTag(state)
+    q_tag = tagMDP.Q_value_Tag(state, reward, 7)
+    assert state.sweepReport.converged
+    distance = tagMDP.getDistanceField(state).grid(*tagMDP.find_agent_location(state, "R"))
+    # The cells next to the Runner are worth 10 and cut it off from the rest.
+    expected = np.where(distance == 0, 20.0, 11.0 - distance)
+    np.testing.assert_array_equal(q_tag, np.where(distance != UNREACHABLE, expected, -np.inf))